@@ -0,0 +1,126 @@
+#!/usr/bin/python
+'''
+Measures how many objects per second the templates of a phase extract from a
+saved corpus. The corpus is a directory of html files or a recorded crawl
+(see ScrapeModel.record). With --baseline the templates are also walked the
+way the parser did before they were compiled into plans, for comparison.
+
+    python benchmarks/parse_benchmark.py nu_nl corpus/ --phase 1 --baseline
+'''
+from copy import deepcopy
+from functools import partial
+import importlib
+import os
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modelscraper.components import ScrapeModel, Source  # noqa
+from modelscraper.records import Record  # noqa
+from modelscraper.warc import open_archive  # noqa
+from modelscraper.workers.parse_pool import ParseContext  # noqa
+
+
+def load_corpus(path):
+    html_files = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                  if f.endswith(('.html', '.htm'))] \
+        if os.path.isdir(path) else []
+    if html_files:
+        for html_file in html_files:
+            with open(html_file, 'rb') as fle:
+                yield html_file, fle.read()
+    else:
+        archive = open_archive(path)
+        for key in archive:
+            yield key, archive.body(key)
+
+
+def interpreted_objects(parser, template, extracted, source):
+    '''
+    Creates the objects like BaseParser._gen_objects did before the
+    templates were compiled: every attr is replicated, with its converters
+    and validators, for every element and the functions are applied
+    recursively.
+    '''
+    schema, values, n_empty = parser._layout(template, source)
+    positions = schema.positions
+    for data in extracted:
+        objct = Record(schema, values[:])
+        no_value = 0
+        for attr in template.attrs.values():
+            elements = parser._apply_selector(attr.selector, data)
+            parsed = apply_funcs(elements, attr.func, attr.kws)
+            if attr.type and type(parsed) != attr.type:
+                print('Not the same type')
+            new_attr = attr._replicate(name=attr.name, value=parsed, func='',
+                                       selector=None, source=attr.source)
+            if attr.source and parsed:
+                parser.parent.new_sources.append((objct, new_attr))
+            objct.values[positions[attr.name]] = new_attr.value
+            if not new_attr.value:
+                no_value += 1
+        if no_value == n_empty:
+            continue
+        yield objct
+
+
+def apply_funcs(elements, parse_funcs, kws):
+    if len(parse_funcs) == 1:
+        return parse_funcs[0](elements, **kws[0])
+    parsed = parse_funcs[0](elements, **kws[0])
+    return apply_funcs(parsed, parse_funcs[1:], kws[1:])
+
+
+def run(model, phase, pages, repeat, baseline=False):
+    '''
+    Returns the number of objects and the time spent executing the
+    templates. Reading the html is left out, it is the same either way.
+    '''
+    parser = phase.parser(parent=ParseContext(model.name, model),
+                          templates=deepcopy(phase.templates))
+    sources = [Source(url=url, data=data) for url, data in pages]
+    prepared = [(source, parser._prepare_data(source)) for source in sources]
+
+    gen_objects = parser._gen_objects
+    if baseline:
+        gen_objects = partial(interpreted_objects, parser)
+    n_objects = 0
+    duration = 0
+    for _ in range(repeat):
+        for source, data in prepared:
+            start = time.time()
+            for template in parser.templates:
+                extracted = parser._extract(data, template)
+                for objct in gen_objects(template, extracted, source):
+                    n_objects += 1
+            duration += time.time() - start
+            parser.parent.collect()
+    return n_objects, duration
+
+
+@click.command()
+@click.argument('model')
+@click.argument('corpus')
+@click.option('--phase', default=0, help='The index of the phase to parse')
+@click.option('--repeat', default=3, help='How often to parse the corpus')
+@click.option('--baseline', is_flag=True,
+              help='Also time the templates without compiling them')
+def main(model, corpus, phase, repeat, baseline):
+    imported = vars(importlib.import_module(f'scrape_models.{model}'))
+    model = [m for m in imported.values() if type(m) == ScrapeModel][0]
+    phase = model.phases[phase]
+    pages = list(load_corpus(corpus))
+    print('Parsing', len(pages), 'pages', repeat, 'times')
+
+    for interpreted in (True, False) if baseline else (False,):
+        n_objects, duration = run(model, phase, pages, repeat, interpreted)
+        print('{:<12} {:>8} objects {:>8.2f}s {:>10.0f} objects/s'.format(
+            'baseline' if interpreted else 'compiled', n_objects, duration,
+            n_objects / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from urllib.parse import urlencode
+import hashlib
+import json
+import os
+import re
+import time
+
+from .helpers import atomic_write
+
+
+def fingerprint(method, url, params=None, data=None):
+    '''
+    Returns a key that identifies a request by its method, url, parameters
+    and body. The parameters are sorted and merged into the url, so a url
+    with the query already in it gets the same key.
+    '''
+    if params:
+        query = urlencode(sorted(params.items()), doseq=True)
+        url += ('&' if '?' in url else '?') + query
+    if isinstance(data, dict):
+        data = urlencode(sorted(data.items()), doseq=True)
+    if isinstance(data, bytes):
+        data = data.decode('latin-1')
+    request = '\n'.join((method.upper(), url, data or ''))
+    return hashlib.sha1(request.encode('utf8')).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, cache, key, meta):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+
+    @property
+    def body(self):
+        with open(self.cache._path(self.key), 'rb') as fle:
+            return fle.read()
+
+    @property
+    def fresh(self):
+        return time.time() < self.meta['expires']
+
+    def validators(self):
+        '''
+        The headers that make the request conditional on the cached version.
+        '''
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+
+class ResponseCache:
+    '''
+    Keeps the responses of the WebSource on disk, keyed by the fingerprint of
+    the request. Every response is stored in two files: the body and a json
+    file with the headers needed to revalidate it.
+    Cache-Control, Expires, ETag and Last-Modified are honoured, `ttl` keeps
+    responses fresh for at least that many seconds, which is useful while
+    developing a model. The least recently used responses are removed when
+    the cache grows larger than `max_size` bytes.
+    '''
+    max_age = re.compile(r'(?:s-)?max-age=(\d+)')
+
+    def __init__(self, path, max_size=2 ** 30, ttl=0):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self._load()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._path(key) + '.json') as fle:
+                meta = json.load(fle)
+            # The modification time is used to restore the order on startup.
+            os.utime(self._path(key) + '.json')
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(self, key, meta)
+
+    def body(self, key):
+        entry = self.get(key)
+        if entry:
+            return entry.body
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.entries))
+
+    def put(self, key, url, headers, body):
+        cache_control = headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return
+
+        meta = {'url': url,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'content_type': headers.get('Content-Type'),
+                'size': len(body),
+                'stored': time.time()}
+        meta['expires'] = self._expires(meta['stored'], headers)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(path, body)
+        self._write(path + '.json', json.dumps(meta).encode('utf8'))
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries[key]
+            self.entries[key] = len(body)
+            self.size += len(body)
+            self._evict()
+
+    def refresh(self, key, headers):
+        '''
+        Updates the freshness of an entry after a 304 Not Modified response.
+        '''
+        entry = self.get(key)
+        if entry:
+            entry.meta['stored'] = time.time()
+            entry.meta['expires'] = self._expires(entry.meta['stored'],
+                                                  headers)
+            self._write(self._path(key) + '.json',
+                        json.dumps(entry.meta).encode('utf8'))
+        return entry
+
+    def _expires(self, stored, headers):
+        cache_control = headers.get('Cache-Control', '').lower()
+        expires = 0
+        if 'no-cache' not in cache_control:
+            max_age = self.max_age.search(cache_control)
+            if max_age:
+                expires = stored + int(max_age.group(1))
+            elif headers.get('Expires'):
+                try:
+                    expires = parsedate_to_datetime(
+                        headers['Expires']).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        return max(expires, stored + self.ttl)
+
+    def _evict(self):
+        while self.size > self.max_size and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            for path in (self._path(key), self._path(key) + '.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _load(self):
+        found = []
+        if os.path.isdir(self.path):
+            for directory in os.scandir(self.path):
+                if not directory.is_dir():
+                    continue
+                for fle in os.scandir(directory.path):
+                    if fle.name.endswith('.json'):
+                        key = fle.name[:-5]
+                        try:
+                            size = os.path.getsize(self._path(key))
+                        except OSError:
+                            continue
+                        found.append((fle.stat().st_mtime, key, size))
+
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _write(self, path, data):
+        with atomic_write(path) as fle:
+            fle.write(data)
@@ -14,6 +14,16 @@ class BaseModel(object):
     def _replicate(self, **kwargs):
         return self.__class__(**kwargs)
 
+    def _copy(self, **changes):
+        '''
+        Returns a shallow copy with the changes applied, without running the
+        converters and validators again.
+        '''
+        new = object.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new.__dict__.update(changes)
+        return new
+
     def __call__(self, **kwargs):
         return self.__class__(**{**self.__dict__, **kwargs})  # noqa
 
@@ -23,12 +33,16 @@ class Phase:
     active = attr.ib(default=True)
     name = attr.ib(default='')
     n_workers = attr.ib(default=1)
+    concurrency = attr.ib(default=100)
+    adaptive = attr.ib(default=False)
     repeat = attr.ib(default=False)
     sources = attr.ib(default=attr.Factory(list))
+    frontier_size = attr.ib(default=1000)
     source_worker = attr.ib(default=WebSource)
     synchronize = attr.ib(default=False)
     templates = attr.ib(default=attr.Factory(list))
     parser = attr.ib(default=HTMLParser)
+    n_parsers = attr.ib(default=1)
 
 @attr.s
 class Source(BaseModel):
@@ -42,6 +56,7 @@ class Source(BaseModel):
     params = attr.ib(attr.Factory(dict))
     src_template = attr.ib('{}')
     retries = attr.ib(10)
+    attempts = attr.ib(0)
     json_key = attr.ib(None, convert=str_as_tuple)
     duplicate = attr.ib(False)
     copy_attrs = attr.ib(None, convert=str_as_tuple)
@@ -50,6 +65,9 @@ class Source(BaseModel):
     from_db = attr.ib(None, metadata={'Template': 1})
     templates = attr.ib(attr.Factory(list))
     compression = attr.ib('')
+    host_delay = attr.ib(None)
+    host_concurrency = attr.ib(None)
+    frontier_id = attr.ib(None)
 
 
 def source_conv(source):
@@ -127,13 +145,6 @@ class Template(BaseModel):
     def attrs_to_dict(self):
         return {attr.name: attr.value for attr in self.attrs.values()}
 
-    def to_store(self):
-        replica = self.__class__(db=self.db, table=self.table, func=self.func,
-                                 db_type=self.db_type, kws=self.kws,
-                                 name=self.name, url=self.url)
-        replica.objects = self.objects[:]
-        return replica
-
     def attrs_from_dict(self, attr_dict):
         self.attrs = {name: Attr(name=name, value=value) for
                       name, value in attr_dict.items()}
@@ -144,17 +155,22 @@ class Template(BaseModel):
         self.attrs[attr.name] = attr
 
     def __repr__(self):
+        repr_string = ''
         if self.objects:
             for objct in self.objects:
-                repr_string = "Template {}:\n".format(objct.name)
-                for attr in objct.attrs.values():
-                    repr_string += "\t{}: {}\n".format(attr.name, attr.value)
+                repr_string += "Template {}:\n".format(objct.name)
+                for name, value in objct.to_dict().items():
+                    repr_string += "\t{}: {}\n".format(name, value)
         return repr_string
 
 class ScrapeModel:
     def __init__(self, name='', domain='', phases: Phase=[], num_getters=1,
-                 time_out=1, user_agent=None, session=requests.Session(),
-                 awaiting=False, cookies={}, schedule='', **kwargs):
+                 time_out=0.3, user_agent=None, session=requests.Session(),
+                 awaiting=False, cookies={}, schedule='', host_delay=None,
+                 host_concurrency=None, cache=False, replay=None, record=None,
+                 checkpoint=False, resume=False, persist_seen=False,
+                 canonicalize=False, pipeline=False, progress=None, metrics=None,
+                 **kwargs):
         self.name = name
         self.domain = domain
         self.phases = phases
@@ -164,6 +180,23 @@ class ScrapeModel:
         self.awaiting = awaiting
         self.user_agent = user_agent
         self.schedule = schedule
+        # The seconds between two requests to a host. When it is not set
+        # the time_out is spread over the workers of a phase, see
+        # ScrapeWorker._host_delay.
+        self.host_delay = host_delay
+        self.host_concurrency = host_concurrency
+        self.cache = cache
+        self.replay = replay
+        self.record = record
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.persist_seen = persist_seen
+        self.canonicalize = canonicalize
+        self.pipeline = pipeline
+        # The reports per second, by default 2 when the output is a
+        # terminal and none otherwise, see ProgressReporter.
+        self.progress = progress
+        self.metrics = metrics
 
         if cookies:
             print(cookies)
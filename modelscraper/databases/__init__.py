@@ -1,8 +1,14 @@
 from .mongo_db import MongoDB
 from .shell_command import ShellCommand
 from .dummy import DummyDatabase
+from .sqlite import SQLite
+from .parquet import Parquet
+from .jsonl import JSONLines
 
 _threads = {'mongo_db': MongoDB,
             'shell_command': ShellCommand,
             'dummy': DummyDatabase,
+            'sqlite': SQLite,
+            'parquet': Parquet,
+            'jsonl': JSONLines,
             }
@@ -1,4 +1,4 @@
-from ..workers import StoreWorker
+from .store_worker import StoreWorker
 
 
 class DummyDatabase(StoreWorker):
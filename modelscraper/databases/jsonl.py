@@ -0,0 +1,143 @@
+from glob import glob
+from queue import Queue
+from threading import Thread
+import gzip
+import io
+import json
+import os
+import shutil
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .store_worker import StoreWorker
+
+
+class JSONLines(StoreWorker):
+    '''
+    Writes every object as a json line to <template.db>/<template.table>.
+    The lines go to a plain .jsonl file, which is rotated once it is
+    `rotate_size` bytes or `rotate_age` seconds old. A rotated file is
+    compressed by a separate thread with zstd, or gzip when zstandard is
+    not installed, so storing never waits on the compression.
+    '''
+    name = 'jsonl'
+
+    def __init__(self, compression=None, rotate_size=2**26, rotate_age=3600,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.compression = compression or ('zstd' if zstandard else 'gzip')
+        self.rotate_size = rotate_size
+        self.rotate_age = rotate_age
+        self.files = {}
+        self.opened = set()
+
+    def run(self):
+        self.to_compress = Queue()
+        self.compressor = Thread(target=self._compress_files, daemon=True)
+        self.compressor.start()
+        super().run()
+        for key in list(self.files):
+            self._rotate(key)
+        self.to_compress.put(None)
+        self.compressor.join()
+
+    def _handle(self, template):
+        if not template.objects:
+            print('No objects in', template.name)
+            return False
+        key = (template.db, template.table)
+        if key not in self.files:
+            self._open(key)
+        fle, opened = self.files[key]
+        fle.write(''.join(json.dumps(objct.to_dict(), default=str) + '\n'
+                          for objct in template.objects))
+        fle.flush()
+        if fle.tell() >= self.rotate_size or \
+                time.time() - opened >= self.rotate_age:
+            self._rotate(key)
+        return True
+
+    def _open(self, key):
+        db, table = key
+        directory = os.path.join(db, table)
+        os.makedirs(directory, exist_ok=True)
+        # Files left behind by a crash are compressed first.
+        if key not in self.opened:
+            self.opened.add(key)
+            for path in glob(os.path.join(directory, '*.jsonl')):
+                self.to_compress.put(path)
+        path = os.path.join(directory, '{}-{}-{:04}.jsonl'.format(
+            table, time.strftime('%Y%m%d%H%M%S'),
+            len(glob(os.path.join(directory, '*')))))
+        self.files[key] = (open(path, 'w'), time.time())
+
+    def _rotate(self, key):
+        fle, opened = self.files.pop(key)
+        fle.close()
+        self.to_compress.put(fle.name)
+
+    def _compress_files(self):
+        while True:
+            path = self.to_compress.get()
+            if path is None:
+                break
+            start = time.time()
+            if self.compression == 'zstd':
+                target = path + '.zst'
+                with open(path, 'rb') as src, open(target + '.tmp',
+                                                   'wb') as dst:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+            else:
+                target = path + '.gz'
+                with open(path, 'rb') as src, gzip.open(target + '.tmp',
+                                                        'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            os.replace(target + '.tmp', target)
+            os.remove(path)
+            print('compressed', path, 'in', round(time.time() - start, 3),
+                  's')
+
+    def read(self, template=None, url='', **kwargs):
+        '''
+        Streams the stored objects of the template as dicts, or the ones
+        with the given url, from the compressed and the plain files.
+        '''
+        directory = os.path.join(template.db, template.table)
+        paths = sorted(glob(os.path.join(directory, '*.jsonl*')))
+        for path in paths:
+            if path.endswith('.tmp'):
+                continue
+            for line in self._lines(path):
+                try:
+                    values = json.loads(line)
+                except ValueError:
+                    # The last line of a file that is still being written.
+                    continue
+                if url and url != values.get('url') and \
+                        [url] != values.get('url'):
+                    continue
+                yield values
+
+    def _lines(self, path):
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise ImportError('Reading .zst files requires zstandard.')
+            with open(path, 'rb') as fle:
+                reader = zstandard.ZstdDecompressor().stream_reader(fle)
+                yield from io.TextIOWrapper(reader, encoding='utf-8')
+        elif path.endswith('.gz'):
+            with gzip.open(path, 'rt') as fle:
+                yield from fle
+        else:
+            try:
+                with open(path) as fle:
+                    yield from fle
+            except FileNotFoundError:
+                # It was compressed while the files were listed.
+                for compressed in glob(path + '.*'):
+                    if not compressed.endswith('.tmp'):
+                        yield from self._lines(compressed)
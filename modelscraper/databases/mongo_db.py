@@ -4,7 +4,7 @@ import time
 from pymongo import MongoClient, UpdateMany
 from pymongo.collection import Collection
 
-from .store_worker import StoreWorker
+from .store_worker import StoreWorker, first
 from ..helpers import add_other_doc
 
 
@@ -20,10 +20,15 @@ class MongoDB(StoreWorker):
         super().__init__(**kwargs)
         # TODO add connection details
         self.client = MongoClient(connect=False)
+        self.indexed = set()
 
     def _handle(self, template):
         self.db = self.client[template.db]
         self.coll = self.db[template.table]
+        self._ensure_index(template.db, template.table)
+        if template.func == 'update' and template.kws.get('key'):
+            self._ensure_index(template.db, template.table,
+                               template.kws['key'])
 
         if template.objects:
             # Call to the functions in this class
@@ -34,10 +39,21 @@ class MongoDB(StoreWorker):
             print('No objects in', template.name)
         return False
 
+    def _ensure_index(self, db, table, key='url'):
+        '''
+        Creates the index on the url, or on the key the objects are updated
+        by, before the collection is first written or searched. Checked once
+        per collection and key in the process that uses the collection.
+        '''
+        if (db, table, key) not in self.indexed:
+            self.client[db][table].create_index(key, background=True)
+            self.indexed.add((db, table, key))
+
     @add_other_doc(Collection.insert_many)
     def create(self, objects, *args, **kwargs):
         # TODO link from the StoreWorker documentation
         # TODO link to the pymongo documentation
+        kwargs.setdefault('ordered', False)
         return self.coll.insert_many([obj.to_dict() for obj in objects],
                                      *args, **kwargs)
 
@@ -57,25 +73,45 @@ class MongoDB(StoreWorker):
             db_requests = [UpdateMany(query, {method: obj.to_dict()},
                                       upsert=upsert) for obj, query in
                            zip(objects, queries)]
-            return self.coll.bulk_write(db_requests)
+            return self.coll.bulk_write(db_requests, ordered=False)
         return False
 
     @add_other_doc(Collection.find)
-    def read(self, template=None, url='', **kwargs):
-        self.db = self.client[template.db]
-        self.coll = self.db[template.table]
+    def read(self, template=None, url='', fields=None, batch_size=1000,
+             **kwargs):
+        '''
+        Yields the stored documents of the template, or the ones with the
+        given url. `fields` limits the attributes that are fetched.
+        '''
+        coll = self.client[template.db][template.table]
         if url:
-            db_objects = self.coll.find({'url': url}, **kwargs)
-        else:
-            db_objects = self.coll.find(**kwargs)
+            self._ensure_index(template.db, template.table)
+        projection = None
+        if fields:
+            projection = {field: 1 for field in fields}
+            projection.setdefault('_id', 0)
+        yield from coll.find({'url': url} if url else {}, projection,
+                             batch_size=batch_size, **kwargs)
+
+    def read_urls(self, template, batch_size=1000):
+        coll = self.client[template.db][template.table]
+        for db_object in coll.find({}, {'url': 1, '_id': 0},
+                                   batch_size=batch_size):
+            if db_object.get('url'):
+                yield first(db_object['url'])
 
-        for db_object in db_objects:
-            objct = template()
-            objct.attrs_from_dict(db_object)
-            yield objct
+    def urls_stored(self, template, urls):
+        coll = self.client[template.db][template.table]
+        self._ensure_index(template.db, template.table)
+        stored = set()
+        for db_object in coll.find({'url': {'$in': list(urls)}},
+                                   {'url': 1, '_id': 0}):
+            url = db_object.get('url')
+            stored.update(url if type(url) == list else [url])
+        return stored
 
     def _create_queries(self, key, objects):
         if not key:
             return ({'url': obj.url} for obj in objects)
         else:
-            return ({key: obj.attrs[key].value[0]} for obj in objects)
+            return ({key: obj[key][0]} for obj in objects)
@@ -0,0 +1,153 @@
+from glob import glob
+import os
+import time
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+from .. import metrics
+from .store_worker import BUFFERED, StoreWorker, first
+
+
+class Parquet(StoreWorker):
+    '''
+    Writes the objects to Parquet files for analysis with pandas or duckdb,
+    in the directory <template.db>/<template.table>. The rows of a table
+    are buffered until `row_group_size` rows can be written as one row
+    group, a file is closed after `max_rows` rows and then a new one is
+    started. Files are written under a .tmp name and renamed when they are
+    complete, so a glob on *.parquet only sees finished files. The files
+    are also finished at the end of a phase, not at a checkpoint, so the
+    rows of the open files are lost when the crawl crashes.
+
+    Every value is stored as a list, so a column has the same type
+    whether an attr found one element or more.
+    '''
+    name = 'parquet'
+
+    def __init__(self, row_group_size=65536, max_rows=2**20,
+                 compression='zstd', **kwargs):
+        if pyarrow is None:
+            raise ImportError('The parquet database requires pyarrow.')
+        super().__init__(**kwargs)
+        self.row_group_size = row_group_size
+        self.max_rows = max_rows
+        self.compression = compression
+        self.tables = {}
+
+    def _finish(self):
+        # Only finished files can be read.
+        for key in list(self.tables):
+            self._write(key)
+            self._close(key)
+
+    def _handle(self, template):
+        if not template.objects:
+            print('No objects in', template.name)
+            return False
+        key = (template.db, template.table)
+        table = self.tables.setdefault(
+            key, {'columns': {}, 'rows': 0, 'writer': None, 'path': '',
+                  'file_rows': 0})
+        columns = table['columns']
+        for objct in template.objects:
+            values = objct.to_dict()
+            for name in values:
+                if name not in columns:
+                    columns[name] = [None] * table['rows']
+            for name, column in columns.items():
+                column.append(self._value(values.get(name)))
+            table['rows'] += 1
+        if table['rows'] >= self.row_group_size:
+            self._write(key)
+        return BUFFERED
+
+    def _value(self, value):
+        if value is None:
+            return None
+        if type(value) in (list, tuple):
+            return list(value) or None
+        return [value]
+
+    def _write(self, key):
+        table = self.tables[key]
+        rows = table['rows']
+        if not rows:
+            return
+        start = time.time()
+        try:
+            batch = pyarrow.Table.from_pydict(table['columns'])
+            writer = table['writer']
+            if writer and not writer.schema.equals(batch.schema):
+                same = set(batch.schema.names) == set(writer.schema.names)
+                if same:
+                    try:
+                        batch = batch.select(writer.schema.names).cast(
+                            writer.schema)
+                    except pyarrow.ArrowException:
+                        same = False
+                if not same:
+                    # The columns or types changed, continue in a new file.
+                    self._close(key)
+                    writer = None
+            if writer is None:
+                writer = self._open(key, batch.schema)
+            writer.write_table(batch, row_group_size=self.row_group_size)
+        except Exception as E:
+            print('Failed to store', rows, 'rows in {}.{}'.format(*key), E)
+            metrics.store_failed.inc(rows, key)
+            return
+        finally:
+            # The rows are not kept after a failure, they would fail again.
+            table['columns'] = {name: [] for name in table['columns']}
+            table['rows'] = 0
+        self._stored(key[0], key[1], 'create', rows, time.time() - start)
+        table['file_rows'] += rows
+        if table['file_rows'] >= self.max_rows:
+            self._close(key)
+
+    def _open(self, key, schema):
+        db, name = key
+        directory = os.path.join(db, name)
+        os.makedirs(directory, exist_ok=True)
+        table = self.tables[key]
+        table['path'] = os.path.join(directory, '{}-{}-{}.parquet'.format(
+            name, time.strftime('%Y%m%d%H%M%S'), len(glob(
+                os.path.join(directory, '*.parquet')))))
+        table['writer'] = pq.ParquetWriter(table['path'] + '.tmp', schema,
+                                           compression=self.compression)
+        table['file_rows'] = 0
+        return table['writer']
+
+    def _close(self, key):
+        table = self.tables[key]
+        if table['writer']:
+            table['writer'].close()
+            os.replace(table['path'] + '.tmp', table['path'])
+            table['writer'] = None
+
+    def read_urls(self, template, batch_size=65536):
+        paths = sorted(glob(os.path.join(template.db, template.table,
+                                         '*.parquet')))
+        for path in paths:
+            for batch in pq.ParquetFile(path).iter_batches(
+                    batch_size, columns=['url']):
+                for url in batch.column(0).to_pylist():
+                    yield first(url)
+
+    def read(self, template=None, url='', batch_size=1024, **kwargs):
+        '''
+        Streams the stored rows of the template from the finished files as
+        dicts, or the ones with the given url.
+        '''
+        paths = sorted(glob(os.path.join(template.db, template.table,
+                                         '*.parquet')))
+        for path in paths:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size):
+                for row in batch.to_pylist():
+                    if url and first(row.get('url')) != url:
+                        continue
+                    yield row
@@ -1,14 +1,15 @@
 import subprocess
-from ..workers import StoreWorker
+from .store_worker import StoreWorker
 
 
 class ShellCommand(StoreWorker):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def _store(self, item):
+    def _handle(self, item):
         for objct in item.objects:
-            arguments = item.kws['command'].format(**objct).split()
+            arguments = item.kws['command'].format(
+                **objct.to_dict()).split()
 
             print(arguments)
             subprocess.Popen(arguments)
@@ -0,0 +1,158 @@
+import json
+import sqlite3
+
+from .store_worker import StoreWorker
+
+
+class SQLite(StoreWorker):
+    '''
+    Stores the objects in a SQLite database file per template.db, with a
+    table per template.table. The tables are created from the attributes of
+    the template, the url is stored as text and the other values as json.
+    Upserts with func='update' need kws={'key': <attribute name>}, the key
+    gets a unique index.
+    '''
+    name = 'sqlite'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connections = {}
+        self.columns = {}
+
+    def run(self):
+        super().run()
+        for connection in self.connections.values():
+            connection.close()
+
+    def _connect(self, db):
+        path = db if db.endswith(('.db', '.sqlite')) else db + '.sqlite'
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _handle(self, template):
+        if template.db not in self.connections:
+            self.connections[template.db] = self._connect(template.db)
+        self.conn = self.connections[template.db]
+        self.table = template.table
+
+        if template.objects:
+            self._create_table(template.objects)
+            func = getattr(self, template.func, None)
+            if func:
+                return func(template.objects, **template.kws)
+        else:
+            print('No objects in', template.name)
+        return False
+
+    def _create_table(self, objects):
+        '''
+        Creates the table, or adds the columns it is missing.
+        '''
+        key = (self.conn, self.table)
+        columns = self.columns.get(key)
+        if columns is None:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS "{}" ('
+                              'url TEXT)'.format(self.table))
+            columns = self.columns[key] = [
+                row[1] for row in self.conn.execute(
+                    'PRAGMA table_info("{}")'.format(self.table))]
+        for objct in objects:
+            for name in objct.schema.columns:
+                if name not in columns:
+                    self.conn.execute('ALTER TABLE "{}" ADD COLUMN "{}" '
+                                      'TEXT'.format(self.table, name))
+                    columns.append(name)
+        return columns
+
+    def _rows(self, objects, columns):
+        for objct in objects:
+            values = objct.to_dict()
+            yield [objct.url] + [json.dumps(values[name], default=str)
+                                 if name in values else None
+                                 for name in columns[1:]]
+
+    def create(self, objects, *args, **kwargs):
+        '''
+        Inserts the objects with one executemany.
+        '''
+        columns = self.columns[(self.conn, self.table)]
+        query = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            self.table, ', '.join('"{}"'.format(c) for c in columns),
+            ', '.join('?' * len(columns)))
+        with self.conn:
+            self.conn.executemany(query, self._rows(objects, columns))
+        return True
+
+    def update(self, objects, key='', **kwargs):
+        '''
+        Inserts the objects, or updates the rows that have the same value
+        for the key. Without a key the url is used.
+        '''
+        key = key or 'url'
+        columns = self.columns[(self.conn, self.table)]
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS "{0}_{1}" ON '
+                          '"{0}" ("{1}")'.format(self.table, key))
+        query = ('INSERT INTO "{}" ({}) VALUES ({}) ON CONFLICT ("{}") '
+                 'DO UPDATE SET {}').format(
+            self.table, ', '.join('"{}"'.format(c) for c in columns),
+            ', '.join('?' * len(columns)), key,
+            ', '.join('"{0}" = excluded."{0}"'.format(c) for c in columns
+                      if c != key))
+        with self.conn:
+            self.conn.executemany(query, self._rows(objects, columns))
+        return True
+
+    def read_urls(self, template, batch_size=1000):
+        connection = self._connect(template.db)
+        try:
+            cursor = connection.execute(
+                'SELECT url FROM "{}"'.format(template.table))
+            cursor.arraysize = batch_size
+            for row in cursor:
+                yield row[0]
+        except sqlite3.OperationalError:
+            # Nothing was stored in the table yet.
+            pass
+        connection.close()
+
+    def urls_stored(self, template, urls):
+        urls = list(urls)
+        connection = self._connect(template.db)
+        stored = set()
+        try:
+            # Stay below the limit on the number of query parameters.
+            for i in range(0, len(urls), 900):
+                chunk = urls[i:i + 900]
+                stored.update(row[0] for row in connection.execute(
+                    'SELECT url FROM "{}" WHERE url IN ({})'.format(
+                        template.table, ', '.join('?' * len(chunk))),
+                    chunk))
+        except sqlite3.OperationalError:
+            pass
+        connection.close()
+        return stored
+
+    def read(self, template=None, url='', **kwargs):
+        '''
+        Yields the stored objects of the template one by one as dicts, or
+        the ones with the given url.
+        '''
+        connection = self._connect(template.db)
+        query = 'SELECT * FROM "{}"'.format(template.table)
+        args = ()
+        if url:
+            query += ' WHERE url = ?'
+            args = (url,)
+        try:
+            cursor = connection.execute(query, args)
+        except sqlite3.OperationalError:
+            # Nothing was stored in the table yet.
+            connection.close()
+            return
+        columns = [column[0] for column in cursor.description]
+        for row in cursor:
+            yield {name: value if name == 'url' or value is None
+                   else json.loads(value) for name, value in zip(columns, row)}
+        connection.close()
@@ -1,39 +1,153 @@
 from multiprocessing import Process, JoinableQueue
+from queue import Empty
+import signal
+import time
+
+from .. import metrics
+from ..records import Batch, RecordReader
 
 
 unsupported = 'The "{}" function is not supported by the {} adapter'
 
+# Put on the store_q to have everything that was received written, see
+# ScrapeWorker.flush_stores. FLUSH also finishes the files an adapter keeps
+# open, SYNC leaves them open.
+FLUSH = 'flush'
+SYNC = 'sync'
+
+# Returned by the _handle of an adapter that keeps the objects to write them
+# later, it then calls _stored itself.
+BUFFERED = 'buffered'
+
+
+def first(value):
+    '''
+    Stored urls can be a list of one url, returns the url itself.
+    '''
+    if type(value) in (list, tuple):
+        return value[0] if value else None
+    return value
+
 
 class StoreWorker(Process):
-    def __init__(self, cache=10):
+    '''
+    Stores the records it receives on the store_q, packed by a RecordWriter.
+    The records are kept in a buffer per (db, table, func) and written as a
+    Batch with one call to _handle once
+    `cache` objects are buffered, once the oldest object has waited
+    `max_age` seconds, when the worker receives FLUSH or SYNC or when it
+    is stopped.
+    With `metrics` set (see ScrapeModel.metrics) the worker exports the
+    stored objects and the flush times to <metrics_name>.prom.
+    '''
+    def __init__(self, cache=1000, max_age=2):
         super(StoreWorker, self).__init__()
         self.store_q = JoinableQueue()
         self.cache = cache
+        self.max_age = max_age
+        self.metrics = None
+        self.metrics_name = ''
+        self.metrics_labels = {}
 
     def run(self):
+        # The ScrapeWorker stops the store workers after a Ctrl-C, once they
+        # have written what they received.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Only the ScrapeWorker serves its metrics over HTTP.
+        exporter = metrics.exporter(self.metrics, self.metrics_name,
+                                    serve=False)
+        if exporter:
+            metrics.registry.labels = self.metrics_labels
+            exporter.start()
+        self._run()
+        if exporter:
+            exporter.stop()
+
+    def _run(self):
+        self.buffers = {}
+        self.reader = RecordReader()
+        self.stored = 0
+        self.store_time = 0
         while True:
-            template = self.store_q.get()
+            # Checked for every message, a busy queue would otherwise keep
+            # the buffers of the quiet tables from being written.
+            if self.buffers and self._time_to_flush() <= 0:
+                self._flush(old=True)
+            try:
+                message = self.store_q.get(timeout=self._time_to_flush())
+            except Empty:
+                continue
 
-            if template is None:
+            if message is None:
                 print('Store received None')
+                self._flush()
+                self._finish()
                 self.store_q.task_done()
                 break
+            if message in (FLUSH, SYNC):
+                self._flush()
+                if message == FLUSH:
+                    self._finish()
+                self.store_q.task_done()
+                continue
 
-            # Set up the environment before storing the objects.
-            self.res = self._handle(template)
-            '''
-            if template.objects:
-                # Call to the functions in this class
-                func = getattr(self, template.func, None)
-                if func:
-                    result = func(template.objects, **template.kws)
-
-                    if not result:
-                        print('Failed with template', template.name)
-                        print(template)
-            '''
+            for schema, records in self.reader.read(message):
+                self._buffer(schema, records)
             self.store_q.task_done()
-        print('stopping store')
+        print('stopping store, stored {} objects in {}s'.format(
+            self.stored, round(self.store_time, 3)))
+
+    def _buffer(self, schema, records):
+        key = (schema.db, schema.table, schema.func, repr(schema.kws))
+        if key in self.buffers:
+            batch, started = self.buffers[key]
+            batch.objects.extend(records)
+        else:
+            batch = Batch(schema, records)
+            self.buffers[key] = (batch, time.time())
+        if len(batch.objects) >= self.cache:
+            self._flush_batch(key)
+
+    def _time_to_flush(self):
+        if not self.buffers:
+            return None
+        oldest = min(started for batch, started in self.buffers.values())
+        return max(oldest + self.max_age - time.time(), 0)
+
+    def _flush(self, old=False):
+        for key, (batch, started) in list(self.buffers.items()):
+            if not old or time.time() - started >= self.max_age:
+                self._flush_batch(key)
+
+    def _finish(self):
+        '''
+        Called after a FLUSH and when the worker stops, adapters that keep
+        files open finish them here.
+        '''
+
+    def _flush_batch(self, key):
+        batch, started = self.buffers.pop(key)
+        start = time.time()
+        try:
+            self.res = self._handle(batch)
+        except Exception as E:
+            print('Failed to store', batch.name, E)
+            metrics.store_failed.inc(len(batch.objects),
+                                     (batch.db, batch.table))
+            return
+        if self.res != BUFFERED:
+            self._stored(batch.db, batch.table, batch.func,
+                         len(batch.objects), time.time() - start)
+
+    def _stored(self, db, table, func, n_objects, took):
+        labels = (db, table)
+        metrics.stored.inc(n_objects, labels)
+        metrics.store_flush_seconds.observe(took, labels)
+        self.stored += n_objects
+        self.store_time += took
+        print('stored {} objects in {}.{} ({}) in {}s, {} objects/s'.format(
+            n_objects, db, table, func, round(took, 3),
+            round(n_objects / max(took, 1e-6))))
 
     def create(self, objects, *args, **kwargs):
         '''
@@ -44,10 +158,28 @@ class StoreWorker(Process):
 
     def read(self, *args, **kwargs):
         '''
-        Read an entry from the database.
+        Yields the stored objects of a template as dicts of their values.
         '''
         raise NotImplementedError
 
+    def read_urls(self, template, batch_size=1000):
+        '''
+        Yields the urls of the stored objects of the template. Adapters
+        override this to read only the url field.
+        '''
+        for row in self.read(template=template, fields=['url']):
+            if row.get('url'):
+                yield first(row['url'])
+
+    def urls_stored(self, template, urls):
+        '''
+        Returns the set of the given urls that are stored for the template.
+        Adapters override this to look them up in one query.
+        '''
+        return {url for url in urls
+                if next(iter(self.read(template=template, url=url,
+                                       fields=['url'])), None)}
+
     def update(self, *args, **kwargs):
         '''
         Performs an update to the database based on the key specified.
@@ -0,0 +1,152 @@
+from threading import Lock
+import pickle
+import sqlite3
+import time
+
+
+class Frontier:
+    '''
+    Keeps the state of a crawl on disk so a crashed or interrupted crawl can
+    be resumed with `run.py <model> --resume`. The sources that were queued
+    but not parsed yet, the sources forwarded to the next phase, the index of
+    the running phase, the amount of sources taken from the phase and the
+    seen filters are stored in a SQLite database.
+    Changes are buffered in memory and written in one transaction per
+    checkpoint, so the crawl does not wait on the disk for every url. A crash
+    loses at most the sources found since the last checkpoint.
+    The filters grow with the crawl, so they are only written every
+    `filter_interval` seconds and at the end of a phase. The sources that
+    are stored are added to the filters again on a resume.
+    '''
+    def __init__(self, path, interval=5, filter_interval=300):
+        self.path = path
+        self.interval = interval
+        self.filter_interval = filter_interval
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sources ('
+                        'id INTEGER PRIMARY KEY, phase INTEGER, '
+                        'forwarded INTEGER, source BLOB)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS state ('
+                        'key TEXT PRIMARY KEY, value BLOB)')
+        self.db.commit()
+        self.next_id = self.db.execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM sources').fetchone()[0]
+        self.added = {}
+        self.finished = []
+        self.last_checkpoint = self.last_filters = time.time()
+        self.lock = Lock()
+        self.unpicklable = False
+
+    def add(self, source, phase, forwarded=False):
+        '''
+        Buffers a source that was queued in the phase, or forwarded to it.
+        '''
+        try:
+            blob = pickle.dumps(source)
+        except Exception as E:
+            if not self.unpicklable:
+                print('Frontier cannot store', source.url, E)
+                self.unpicklable = True
+            return
+        with self.lock:
+            source.frontier_id = self.next_id
+            self.next_id += 1
+            self.added[source.frontier_id] = (phase, int(forwarded), blob)
+
+    def done(self, source):
+        '''
+        Marks a source as parsed or dropped.
+        '''
+        if source.frontier_id is None:
+            return
+        with self.lock:
+            if self.added.pop(source.frontier_id, None) is None:
+                self.finished.append((source.frontier_id,))
+
+    def checkpoint(self, filters=None, **state):
+        '''
+        Writes the buffered sources and the state in one transaction. The
+        filters are a dict of state that is only given when it is due.
+        '''
+        if filters:
+            state.update(filters)
+        with self.lock:
+            added = [(id, phase, forwarded, blob) for id, (
+                phase, forwarded, blob) in self.added.items()]
+            finished = self.finished
+            self.added = {}
+            self.finished = []
+        with self.db:
+            self.db.executemany('INSERT INTO sources VALUES (?, ?, ?, ?)',
+                                added)
+            self.db.executemany('DELETE FROM sources WHERE id = ?', finished)
+            self.db.executemany(
+                'INSERT OR REPLACE INTO state VALUES (?, ?)',
+                [(key, pickle.dumps(value)) for key, value in state.items()])
+        self.last_checkpoint = time.time()
+        if filters:
+            self.last_filters = self.last_checkpoint
+
+    def due(self):
+        return time.time() - self.last_checkpoint > self.interval
+
+    def filters_due(self):
+        return time.time() - self.last_filters > self.filter_interval
+
+    def end_phase(self, index, consumed=True, filters=None, **state):
+        '''
+        Drops the sources that were left in the queue of the finished phase
+        and, when it took them, the sources forwarded to it by the earlier
+        phases.
+        '''
+        self.checkpoint(filters, **state)
+        with self.db:
+            self.db.execute('DELETE FROM sources WHERE phase = ? AND '
+                            'forwarded = 0', (index,))
+            if consumed:
+                self.db.execute('DELETE FROM sources WHERE phase < ? AND '
+                                'forwarded = 1', (index,))
+
+    def state(self, key, default=None):
+        row = self.db.execute('SELECT value FROM state WHERE key = ?',
+                              (key,)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def pending(self, phase):
+        '''
+        Returns the sources that were queued in the phase but not parsed.
+        '''
+        return list(self._sources('phase = ? AND forwarded = 0', phase))
+
+    def forwarded(self, phase, before=False):
+        '''
+        Yields the sources forwarded by the phase, or by all the phases
+        before it, in the order they were found.
+        '''
+        where = 'phase < ?' if before else 'phase = ?'
+        yield from self._sources(where + ' AND forwarded = 1', phase)
+
+    def _sources(self, where, *args):
+        # A connection of its own, so the sources can be read lazily while
+        # the crawl keeps writing checkpoints.
+        db = sqlite3.connect(self.path)
+        rows = db.execute('SELECT id, source FROM sources WHERE ' + where +
+                          ' ORDER BY id', args)
+        for id, blob in rows:
+            source = pickle.loads(blob)
+            source.frontier_id = id
+            yield source
+        db.close()
+
+    def clear(self):
+        with self.lock:
+            self.added = {}
+            self.finished = []
+        with self.db:
+            self.db.execute('DELETE FROM sources')
+            self.db.execute('DELETE FROM state')
+
+    def close(self):
+        self.db.close()
@@ -1,7 +1,13 @@
 import lxml.cssselect
 from collections import OrderedDict
+from contextlib import contextmanager
 from lxml.etree import XPath
 import attr
+from threading import get_ident
+import mmap
+import os
+
+from pybloom import ScalableBloomFilter
 
 
 #TODO move the selectors to a seperate folder and/or file
@@ -60,6 +66,54 @@ def source_conv(source):
 '''
 
 
+def apply_src_template(source, url):
+    if source.src_template:
+        # use formatting notation in the src_template
+        return source.src_template.format(url)
+    return url
+
+
+def load_filter(path):
+    '''
+    Loads a Bloom filter that was written by save_filter. The file is
+    memory mapped only while it is read, the filter is a copy in memory.
+    Returns an empty filter when the file does not exist or is empty.
+    '''
+    try:
+        with open(path, 'rb') as fle:
+            if not os.fstat(fle.fileno()).st_size:
+                return ScalableBloomFilter()
+            with mmap.mmap(fle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return ScalableBloomFilter.fromfile(mm)
+    except FileNotFoundError:
+        return ScalableBloomFilter()
+
+
+def save_filter(bloom, path):
+    '''
+    Writes the bits of a Bloom filter to path.
+    '''
+    with atomic_write(path) as fle:
+        bloom.tofile(fle)
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    '''
+    Opens a temporary file that replaces path once it is written, so a
+    crash or a reader never sees half a file. Every thread gets a
+    temporary file of its own.
+    '''
+    tmp = '{}.{}.tmp'.format(path, get_ident())
+    try:
+        with open(tmp, mode) as fle:
+            yield fle
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
 def str_as_tuple(something):
     if something is not None:
         if type(something) in [list, dict, tuple]:
@@ -0,0 +1,261 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread, local
+import os
+
+from .helpers import atomic_write
+
+
+class Metric:
+    '''
+    A metric family with a value per combination of label values. Every
+    thread records in its own dict, so recording never takes a lock, the
+    values of the threads are added up when the metric is rendered.
+    '''
+    type = ''
+
+    def __init__(self, name, help='', labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.local = local()
+        self.shards = []
+        self.lock = Lock()
+
+    def _values(self):
+        values = getattr(self.local, 'values', None)
+        if values is None:
+            values = self.local.values = {}
+            # Only taken the first time a thread records.
+            with self.lock:
+                self.shards.append(values)
+        return values
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def samples(self):
+        totals = {}
+        for shard in list(self.shards):
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        for labels, value in totals.items():
+            yield '_total', labels, (), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help='', labels=(),
+                 buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, labels=()):
+        values = self._values()
+        counts = values.get(labels)
+        if counts is None:
+            # The counts per bucket, the one for +Inf and the sum.
+            counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        totals = {}
+        for shard in list(self.shards):
+            for labels, counts in list(shard.items()):
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        for labels, counts in totals.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', labels, (('le', str(bound)),), cumulative
+            yield '_count', labels, (), cumulative
+            yield '_sum', labels, (), counts[-1]
+
+
+class Gauge(Metric):
+    '''
+    A gauge that calls `func` when it is rendered, so nothing is recorded
+    while scraping. The function returns a number, or a dict with a number
+    per tuple of label values.
+    '''
+    type = 'gauge'
+
+    def __init__(self, name, help='', func=None, labels=()):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def samples(self):
+        values = self.func()
+        if type(values) != dict:
+            values = {(): values}
+        for labels, value in values.items():
+            yield '', labels, (), value
+
+
+class Registry:
+    '''
+    The metrics of one process. They are rendered in the OpenMetrics text
+    format with the constant `labels` added, families without samples are
+    left out.
+    '''
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.metrics = {}
+
+    def _add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help='', labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help='', labels=(), **kwargs):
+        return self._add(Histogram(name, help, labels, **kwargs))
+
+    def gauge(self, name, help='', func=None, labels=()):
+        # A gauge is set up again with the function of the new process.
+        self.metrics[name] = Gauge(name, help, func, labels)
+        return self.metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            samples = list(metric.samples())
+            if not samples:
+                continue
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            if metric.help:
+                lines.append('# HELP {} {}'.format(metric.name,
+                                                   escape(metric.help)))
+            for suffix, values, extra, value in samples:
+                labels = list(self.labels.items()) + \
+                    list(zip(metric.labels, values)) + list(extra)
+                label_string = ','.join('{}="{}"'.format(name, escape(value))
+                                        for name, value in labels)
+                lines.append('{}{}{} {}'.format(
+                    metric.name, suffix,
+                    '{' + label_string + '}' if label_string else '', value))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''
+        Writes the metrics to a textfile, replacing it at once so a
+        collector never reads half a file.
+        '''
+        with atomic_write(path, 'w') as fle:
+            fle.write(self.render())
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+class MetricsExporter(Thread):
+    '''
+    Writes the registry to the textfile at `path` every `interval` seconds
+    and when it is stopped. With a port the metrics are also served over
+    HTTP on localhost.
+    '''
+    def __init__(self, registry, path=None, port=None, interval=15):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.stopped = Event()
+        self.server = None
+
+    def run(self):
+        if self.port:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = registry.render().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type',
+                                     'application/openmetrics-text; '
+                                     'version=1.0.0; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port),
+                                              Handler)
+            Thread(target=self.server.serve_forever, daemon=True).start()
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        if self.path:
+            self.registry.write(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.export()
+        if self.server:
+            self.server.shutdown()
+
+
+def exporter(options, name, serve=True):
+    '''
+    Creates the exporter for ScrapeModel.metrics, which is the directory
+    for the textfiles or a dict with the path, port and interval. The
+    textfile is called <name>.prom.
+    '''
+    if not options:
+        return None
+    if type(options) != dict:
+        options = {'path': options}
+    options = dict(options)
+    if not serve:
+        options.pop('port', None)
+    directory = options.pop('path', None)
+    path = None
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name + '.prom')
+    return MetricsExporter(registry, path=path, **options)
+
+
+# The registry of this process, the store workers and the ScrapeWorker
+# each have their own.
+registry = Registry()
+
+fetched = registry.counter('modelscraper_fetched',
+                           'Sources that were retrieved')
+fetch_seconds = registry.histogram('modelscraper_fetch_seconds',
+                                   'Time to retrieve a source')
+retried = registry.counter('modelscraper_retried',
+                           'Sources that were scheduled for a retry')
+dropped = registry.counter('modelscraper_dropped',
+                           'Sources that did not reach the parser')
+parsed = registry.counter('modelscraper_parsed', 'Sources that were parsed')
+parse_seconds = registry.histogram('modelscraper_parse_seconds',
+                                   'Time to parse a template of a source',
+                                   ('template',))
+stored = registry.counter('modelscraper_stored', 'Objects that were stored',
+                          ('db', 'table'))
+store_failed = registry.counter('modelscraper_store_failed',
+                                'Objects that could not be stored',
+                                ('db', 'table'))
+store_flush_seconds = registry.histogram('modelscraper_store_flush_seconds',
+                                         'Time to write a batch of objects',
+                                         ('db', 'table'))
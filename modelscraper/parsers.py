@@ -1,3 +1,4 @@
+from collections import OrderedDict, namedtuple
 from io import BytesIO
 from datetime import datetime
 from functools import reduce
@@ -17,9 +18,15 @@ from lxml.cssselect import CSSSelector, SelectorSyntaxError
 from scrapely import Scraper
 
 from .helpers import str_as_tuple, add_other_doc
+from .records import Batch, Record, Schema
 sys.setrecursionlimit(10000000)
 
 
+# A template compiled by BaseParser._compile, see BaseParser._gen_objects.
+TemplatePlan = namedtuple('TemplatePlan', 'template slots')
+AttrSlot = namedtuple('AttrSlot', 'name selector steps type source prototype')
+
+
 class BaseParser:
     '''
     This class implements the methods:
@@ -28,12 +35,18 @@ class BaseParser:
                      forward it to another run.
     which can all be overridden in subclasses.
     I
+    Every template is compiled into a TemplatePlan once, which is executed
+    for every element.
+    The objects are Records that share the Schema of their template, the
+    Templates and Attrs are only the definitions.
     '''
+
     def __init__(self, parent=None, templates=[], **kwargs):
         if not parent:
             raise Exception('No parent or phase was specified')
         self.name = parent.name
         self.domain = parent.model.domain
+        self.schemas = {}
         # Set all selectors and the functions of the attrs to the correct
         # functions and selectors of the parser.
         self.templates = self._prepare_templates(templates)
@@ -76,6 +89,7 @@ class BaseParser:
             templates = self.templates
 
         for template in templates:
+            template_start = time.time()
             extracted = self._extract(data, template)
             template.objects = list(
                 self._gen_objects(template, extracted, source))
@@ -87,16 +101,71 @@ class BaseParser:
                 print(template.selector, 'yielded nothing, quitting.')
                 self.parent.reset_source_queue()
 
-            yield template.to_store()
+            self.parent.template_parsed(template.name,
+                                        time.time() - template_start)
+            yield Batch(self._layout(template, source)[0], template.objects)
 
         self.total_time += time.time() - start
 
     def _prepare_templates(self, templates):
+        self.plans = {}
         for template in templates:
-            template.selector = self._get_selector(template)
-            for attr in template.attrs.values():
-                attr.func = self._get_funcs(attr.func)
-                attr.selector = self._get_selector(attr)
+            self._prepare_template(template)
+        return templates
+
+    def _prepare_template(self, template):
+        template.selector = self._get_selector(template)
+        for attr in template.attrs.values():
+            attr.func = self._get_funcs(attr.func)
+            attr.selector = self._get_selector(attr)
+        plan = self.plans[id(template)] = self._compile(template)
+        return plan
+
+    def _compile(self, template):
+        '''
+        Compiles a prepared template into a plan: the selectors, the
+        functions with their keyword arguments and the attrs that are copied
+        for the values that create new sources, so nothing has to be looked
+        up, validated or converted while parsing.
+        '''
+        slots = []
+        for attr in template.attrs.values():
+            steps = tuple(zip(attr.func, attr.kws))
+            prototype = attr._replicate(
+                name=attr.name, value=None, func='', selector=None,
+                source=attr.source, attr_condition=attr.attr_condition,
+                source_condition=attr.source_condition)
+            slots.append(AttrSlot(attr.name, attr.selector, steps, attr.type,
+                                  attr.source, prototype))
+        return TemplatePlan(template, tuple(slots))
+
+    def _layout(self, template, source):
+        '''
+        Returns the schema of the objects the template creates from the
+        source, the values every object starts with and the number of attrs
+        of the template, which all have to be empty for the template to
+        fail.
+        The columns are the url, the attrs of the source and the attrs of
+        the template, a template attr replaces a source attr with its name.
+        '''
+        key = (id(template), tuple(source.attrs))
+        if key not in self.schemas:
+            names = OrderedDict()
+            names.update((name, None) for name in source.attrs)
+            names.update((name, None) for name in template.attrs)
+            columns = ('url',) + tuple(name for name in names
+                                       if name != 'url')
+            schema = Schema(None, template.name, template.db,
+                            template.table, template.func, template.kws,
+                            columns)
+            self.schemas[key] = (schema, len(template.attrs))
+        schema, n_empty = self.schemas[key]
+
+        values = [None] * len(schema.columns)
+        values[0] = str_as_tuple(source.url) if source.url else source.url
+        for attr in source.attrs.values():
+            values[schema.positions[attr.name]] = attr.value
+        return schema, values, n_empty
 
     def _get_funcs(self, func_names):
         functions = []
@@ -118,73 +187,51 @@ class BaseParser:
         that create the sources from Attrs or Templates (_gen_source,
         _source_from_object).
         '''
+        plan = self.plans.get(id(template)) or \
+            self._prepare_template(template)
+        schema, values, n_empty = self._layout(template, source)
+        slots = [(slot, schema.positions[slot.name]) for slot in plan.slots]
         for data in extracted:
             # Create a new objct from the template.
-            objct = template._replicate(name=template.name, url=source.url,
-                                        func=template.func)
-
-            # Set predefined attributes from the source.
-            for attr in source.attrs.values():
-                objct.attrs[attr.name] = attr()
+            objct = Record(schema, values[:])
+            row = objct.values
 
+            # We want to count how many attrs return None
             no_value = 0
+            for slot, position in slots:
+                parsed = self._apply_selector(slot.selector, data)
+                for func, kws in slot.steps:
+                    parsed = func(parsed, **kws)
 
-            # Set the attributes.
-            for attr in self._gen_attrs(template.attrs.values(), objct, data):
-                objct.attrs[attr.name] = attr
+                if slot.type and type(parsed) != slot.type:
+                    print('Not the same type')
 
-                if not attr.value:
+                value = row[position] = str_as_tuple(parsed)
+                if not value:
                     no_value += 1
 
-            # We want to count how many attrs return None
+                # Create a request from the attribute if desirable
+                if slot.source and parsed:
+                    self.parent.new_sources.append(
+                        (objct, slot.prototype._copy(value=value)))
+
             # Don't return anything if we have no values for the attributes
-            if no_value == len(objct.attrs) - len(source.attrs):
-                print('Template {} has failed, attempting to use the fallback'.\
-                      format(template.name))
-                print(source.url)
-                if getattr(self, '_fallback', None) and False:
-                    for objct in self._fallback(template, extracted, source):
-                        yield objct
-                    continue
-                else:
-                    print('Template', template.name, 'failed')
-                    print('data', data.text_content())
-                    continue
+            if no_value == n_empty:
+                self._template_failed(template, source, data)
+                continue
 
             # Create a new Source from the template if desirable
-            # TODO fix this.
             if template.source and getattr(self, '_source_from_object', None):
-                objct.source = template.source()
-                self._source_from_object(objct, source)
+                self._source_from_object(objct, source, template)
 
             yield objct
 
-    def _gen_attrs(self, attrs, objct, data):
-        for attr in attrs:
-            elements = self._apply_selector(attr.selector, data)
-
-            # get the parse functions and recursively apply them.
-            parsed = self._apply_funcs(elements, attr.func, attr.kws)
-
-            if attr.type and type(parsed) != attr.type:
-                print('Not the same type')
-
-            new_attr = attr._replicate(name=attr.name, value=parsed, func='',
-                            selector=None, source=attr.source)
-
-            # Create a request from the attribute if desirable
-            # TODO add the source to the attr straightaway.
-            if attr.source and parsed:
-                self.parent.new_sources.append((objct, new_attr))
-
-            yield new_attr
-
-    def _apply_funcs(self, elements, parse_funcs, kws):
-        if len(parse_funcs) == 1 and hasattr(parse_funcs, '__iter__'):
-            return parse_funcs[0](elements, **kws[0])
-        else:
-            parsed = parse_funcs[0](elements, **kws[0])
-            return self._apply_funcs(parsed, parse_funcs[1:], kws[1:])
+    def _template_failed(self, template, source, data):
+        print('Template {} has failed, attempting to use the fallback'.\
+              format(template.name))
+        print(source.url)
+        print('Template', template.name, 'failed')
+        print('data', data.text_content())
 
     def _value(self, parsed, index=None):
         if type(parsed) != list:
@@ -195,27 +242,17 @@ class BaseParser:
 
     # TODO check if this belongs here...
     def _copy_attrs(self, objct, source):
-        # Copy only the attribute with the key
-        if type(source.copy_attrs) == str:
-            if objct.attrs.get(source.copy_attrs):
-                attr = objct.attrs[copy_attrs]._replicate()
-                new_source.attrs[copy_attrs] = attr
-            else:
-                raise Exception('Could not copy attr', copy_attrs)
-
-        # Copy a list of attributes
-        elif hasattr(source.copy_attrs, 'iter'):
-            for attr_name in source.copy_attrs:
-                attr = objct.attrs.get(attr_name)
-                if attr:
-                    new_source.attrs[attr_name] = attr
-                else:
-                    raise Exception('Could not copy all attrs', copy_attrs)
-
-        else: # Copy all the attributes.
-            new_source.attrs = {key: attr._replicate() for key, attr in
-                                objct.attrs.items()}
-        return new_source
+        from .components import Attr
+
+        # A dict stores the copied attributes under different names.
+        copy_attrs = source.copy_attrs
+        if type(copy_attrs) != dict:
+            copy_attrs = {name: name for name in copy_attrs}
+        for name, new_name in copy_attrs.items():
+            if name not in objct:
+                raise Exception('Could not copy attr', name)
+            source.attrs[new_name] = Attr(name=new_name, value=objct[name])
+        return source
 
     def modify_text(self, text, replacers=None, substitute='', regex: str='',
                 numbers: bool=False, needle=None):
@@ -341,18 +378,20 @@ class HTMLParser(BaseParser):
                 extracted.extend(json.loads(script))
         return extracted
 
-    def _source_from_object(self, objct, source):
+    def _source_from_object(self, objct, source, template):
         # TODO fix that the source object can determine for itself where data
         # or params should be placed in the object.
-        new_source = objct.source._replicate()
-        attrs = {attr.name: attr.value for attr in objct.attrs.values()
-                    if attr.name != 'url'}
+        from .components import Attr
+
+        new_source = template.source(attrs=dict(template.source.attrs))
+        attrs = {name: value for name, value in objct.to_dict().items()
+                 if name != 'url'}
 
         if not getattr(new_source, 'url', None):
-            url = objct.attrs.get('url')
+            url = objct.url
 
-            if url and not isinstance(url, list):
-                new_source.url = self.parent._apply_src_template(source, url.value)
+            if url:
+                new_source.url = self.parent._apply_src_template(source, url)
             else:
                 new_source.url = self.parent._apply_src_template(source, source.url)
 
@@ -360,7 +399,8 @@ class HTMLParser(BaseParser):
             new_source = self._copy_attrs(objct, new_source)
 
         if new_source.parent:
-            new_source.attrs['_parent'] = objct.attrs['url']._replicate()
+            new_source.attrs['_parent'] = Attr(name='_parent',
+                                               value=objct['url'])
 
         if new_source.method == 'post':
             new_source.data = {**new_source.data, **attrs} # noqa
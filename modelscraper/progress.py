@@ -0,0 +1,69 @@
+from threading import Event, Thread
+import json
+import sys
+import time
+
+
+class ProgressReporter(Thread):
+    '''
+    Shows the progress of a ScrapeWorker from its own thread, `rate` times
+    a second, so the parse loop never waits for it. On a terminal the
+    report is redrawn in place with ANSI codes. When the output is not a
+    terminal, or with machine=True, every report is written as one json
+    line instead. The ScrapeWorker only reports to a terminal, unless
+    ScrapeModel.progress is set.
+    '''
+    def __init__(self, worker, rate=2, stream=None, machine=None):
+        super().__init__(daemon=True)
+        self.worker = worker
+        self.interval = 1 / rate
+        self.stream = stream or sys.stdout
+        if machine is None:
+            machine = not self.stream.isatty()
+        self.machine = machine
+        self.stopped = Event()
+        self.started = self.sampled = time.time()
+        self.last = {}
+        self.lines = 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.report()
+
+    def sample(self):
+        '''
+        Reads the counters of the running phases and adds the number of
+        sources parsed per second since the last sample.
+        '''
+        now = time.time()
+        phases = self.worker.progress()
+        for phase in phases:
+            parsed, then = self.last.get(phase['phase'], (0, self.sampled))
+            phase['rate'] = round((phase['parsed'] - parsed) /
+                                  max(now - then, 1e-6), 1)
+            self.last[phase['phase']] = (phase['parsed'], now)
+        self.sampled = now
+        return {'model': self.worker.model.name,
+                'elapsed': round(now - self.started, 1), 'phases': phases}
+
+    def report(self):
+        sample = self.sample()
+        if self.machine:
+            self.stream.write(json.dumps(sample) + '\n')
+        else:
+            lines = ['{model}  {elapsed}s'.format(**sample)]
+            lines += ['phase {phase} {name}  queued {queued}  in flight '
+                      '{in_flight}  parsed {parsed} ({rate}/s)  get '
+                      '{get_time}s  parse {parse_time}s'.format(**phase)
+                      for phase in sample['phases']]
+            # Go back to the start of the last report and clear it.
+            if self.lines:
+                self.stream.write('\x1b[{}F\x1b[J'.format(self.lines))
+            self.stream.write('\n'.join(lines) + '\n')
+            self.lines = len(lines)
+        self.stream.flush()
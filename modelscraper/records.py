@@ -0,0 +1,175 @@
+import pickle
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Schema:
+    '''
+    Describes the records of one template: where they are stored and the
+    names of their columns. A schema is sent to a store worker once, after
+    that the records only carry the schema id and their values.
+    '''
+    __slots__ = ('id', 'name', 'db', 'table', 'func', 'kws', 'columns',
+                 'positions')
+
+    def __init__(self, id, name, db, table, func, kws, columns):
+        self.id = id
+        self.name = name
+        self.db = db
+        self.table = table
+        self.func = func
+        self.kws = kws
+        self.columns = columns
+        self.positions = {name: i for i, name in enumerate(columns)}
+
+    def to_tuple(self):
+        return (self.id, self.name, self.db, self.table, self.func,
+                self.kws, self.columns)
+
+
+class Record:
+    '''
+    An object created by the parser from a Template, a list of values with
+    the schema of the template that names them. The store workers receive
+    the same records, with a tuple of values.
+    '''
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    @property
+    def url(self):
+        url = self.values[0]
+        if type(url) in (list, tuple) and url:
+            return url[0]
+        return url
+
+    @property
+    def name(self):
+        return self.schema.name
+
+    def __getitem__(self, name):
+        return self.values[self.schema.positions[name]]
+
+    def __contains__(self, name):
+        return name in self.schema.positions
+
+    def get(self, name, default=None):
+        if name in self.schema.positions:
+            return self[name]
+        return default
+
+    def to_dict(self):
+        return dict(zip(self.schema.columns, self.values))
+
+
+class Batch:
+    '''
+    The records that are written to one table with one call to the
+    database, it has the same fields as the Template it came from.
+    '''
+    def __init__(self, schema, objects=None):
+        self.name = schema.name
+        self.db = schema.db
+        self.table = schema.table
+        self.func = schema.func
+        self.kws = schema.kws
+        self.objects = objects or []
+
+    def __repr__(self):
+        repr_string = ''
+        for objct in self.objects:
+            repr_string += "Template {}:\n".format(objct.name)
+            for name, value in zip(objct.schema.columns, objct.values):
+                repr_string += "\t{}: {}\n".format(name, value)
+        return repr_string
+
+
+def encode(message):
+    '''
+    Packs a message with msgpack, values msgpack cannot handle (dates, sets)
+    make the message fall back to pickle.
+    '''
+    if msgpack:
+        try:
+            return b'm' + msgpack.packb(message, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return b'p' + pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(data):
+    if data[:1] == b'm':
+        return msgpack.unpackb(data[1:], raw=False, use_list=False,
+                               strict_map_key=False)
+    return pickle.loads(data[1:])
+
+
+class RecordWriter:
+    '''
+    Turns the templates of the parser into rows and puts them on the queue
+    of a store worker, `batch_size` rows per message. A message holds the
+    schemas the store worker has not seen yet and the rows per schema id.
+    '''
+    def __init__(self, queue, batch_size=100, max_age=1):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.schemas = {}
+        self.new_schemas = []
+        self.rows = {}
+        self.n_rows = 0
+        self.started = 0
+
+    def add(self, template):
+        for objct in template.objects:
+            key = (template.name, tuple(objct.schema.columns))
+            schema = self.schemas.get(key)
+            if schema is None:
+                schema = Schema(len(self.schemas), template.name, template.db,
+                                template.table, template.func, template.kws,
+                                key[1])
+                self.schemas[key] = schema
+                self.new_schemas.append(schema.to_tuple())
+            row = tuple(objct.values)
+            if not self.n_rows:
+                self.started = time.time()
+            self.rows.setdefault(schema.id, []).append(row)
+            self.n_rows += 1
+        if self.n_rows >= self.batch_size:
+            self.flush()
+
+    def due(self):
+        return self.n_rows and time.time() - self.started > self.max_age
+
+    def flush(self):
+        if not self.n_rows and not self.new_schemas:
+            return
+        self.queue.put(encode((self.new_schemas, list(self.rows.items()))))
+        self.new_schemas = []
+        self.rows = {}
+        self.n_rows = 0
+
+
+class RecordReader:
+    '''
+    The store worker side of the RecordWriter, keeps the schemas and yields
+    the records of a message per schema.
+    '''
+    def __init__(self):
+        self.schemas = {}
+
+    def read(self, data):
+        new_schemas, rows = decode(data)
+        for schema in new_schemas:
+            schema = Schema(*schema)
+            self.schemas[schema.id] = schema
+        for id, values in rows:
+            schema = self.schemas[id]
+            yield schema, [Record(schema, row) for row in values]
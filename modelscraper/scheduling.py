@@ -0,0 +1,377 @@
+from collections import Counter, OrderedDict, deque
+from heapq import heappop, heappush
+from itertools import count
+from queue import Empty
+from threading import Condition, Lock
+from urllib.parse import urlsplit
+import json
+import random
+import time
+
+
+class Hosts:
+    '''
+    The requests in flight and the time of the next request per host. The
+    HostSchedulers of pipelined phases share one, so the delay and the
+    concurrency of a host hold for the phases together.
+    '''
+    def __init__(self):
+        self.active = Counter()
+        self.ready_at = {}
+        self.condition = Condition()
+
+
+class HostScheduler:
+    '''
+    Sits between the source_q and the source workers and hands out the
+    sources per host. Every host gets its own delay between requests and its
+    own cap on the number of requests in flight, so a slow host does not
+    hold up the sources for other hosts.
+    The defaults come from the ScrapeModel (host_delay, host_concurrency) and
+    can be overridden by the Source attributes with the same names. Without
+    a host_delay the ScrapeWorker sets the delay per phase, to the time_out
+    of the model divided by the requests its workers make at once.
+    Schedulers created with the same `hosts` share the state per host.
+    '''
+    def __init__(self, in_q, delay=0, concurrency=None, retries=None,
+                 hosts=None):
+        self.in_q = in_q
+        self.retries = retries
+        self.delay = delay
+        self.concurrency = concurrency
+        # Without per_host the sources are handed out in order, for the
+        # source workers that do not visit a host.
+        self.per_host = True
+        self.pending = OrderedDict()
+        self.hosts = hosts or Hosts()
+        self.active = self.hosts.active
+        self.ready_at = self.hosts.ready_at
+        # The ready_at of the host before and after a source was handed out.
+        self.granted = {}
+        self.waiting = 0
+        self.condition = self.hosts.condition
+
+    def get(self, timeout=1):
+        '''
+        Returns the next source which host can be visited, raises Empty
+        when no source became available within the timeout.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            with self.condition:
+                self._drain()
+                now = time.time()
+                source, wait = self._pop_ready(now)
+                if source is not None:
+                    return source
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise Empty
+                if self.waiting:
+                    # Sources wait for a busy host, new sources might arrive
+                    # in the meantime so don't wait too long.
+                    self.condition.wait(min(wait, remaining, 0.1))
+                    continue
+                if self.retries:
+                    remaining = min(remaining, self.retries.next_due() - now)
+
+            # Nothing is waiting, so block on the queue itself.
+            try:
+                source = self.in_q.get(timeout=max(remaining, 0))
+            except Empty:
+                if self.retries and self.retries.next_due() < deadline:
+                    continue
+                raise
+            self.in_q.task_done()
+            with self.condition:
+                self._file(source)
+
+    def done(self, source, requested=True):
+        '''
+        Releases the slot of the host of the source after it is retrieved.
+        When no request was sent, for instance for a fresh cached response,
+        the host does not wait for the delay of the source.
+        '''
+        with self.condition:
+            if id(source) in self.granted:
+                host = self._host(source)
+                self.active[host] -= 1
+                before, after = self.granted.pop(id(source))
+                if not requested and self.ready_at.get(host) == after:
+                    self.ready_at[host] = before
+            self.condition.notify_all()
+
+    def empty(self):
+        return not self.waiting and self.in_q.empty() and not self.retries
+
+    def qsize(self):
+        return self.waiting + self.in_q.qsize() + len(self.retries or ())
+
+    def clear(self):
+        '''
+        Removes the sources that were not handed out yet and returns them.
+        '''
+        with self.condition:
+            cleared = [source for sources in self.pending.values()
+                       for source in sources]
+            self.pending.clear()
+            self.waiting = 0
+            if self.retries:
+                cleared.extend(self.retries.clear())
+        return cleared
+
+    def _drain(self):
+        if self.retries:
+            for source in self.retries.pop_due(time.time()):
+                self._file(source)
+        while True:
+            try:
+                source = self.in_q.get(False)
+            except Empty:
+                return
+            self.in_q.task_done()
+            self._file(source)
+
+    def _file(self, source):
+        host = self._host(source)
+        if host not in self.pending:
+            self.pending[host] = deque()
+        self.pending[host].append(source)
+        self.waiting += 1
+
+    def _pop_ready(self, now):
+        wait = 1
+        for host, sources in self.pending.items():
+            source = sources[0]
+            if not self.per_host:
+                self._pop(host, sources)
+                return source, 0
+
+            concurrency = source.host_concurrency or self.concurrency
+            if concurrency and self.active[host] >= concurrency:
+                continue
+
+            ready_at = self.ready_at.get(host, 0)
+            if ready_at > now:
+                wait = min(wait, ready_at - now)
+                continue
+
+            self._pop(host, sources)
+            delay = self.delay if source.host_delay is None \
+                else source.host_delay
+            self.granted[id(source)] = (ready_at, now + delay)
+            self.ready_at[host] = now + delay
+            self.active[host] += 1
+            return source, 0
+        return None, wait
+
+    def _pop(self, host, sources):
+        sources.popleft()
+        # Move the host to the back so the hosts take turns.
+        if sources:
+            self.pending.move_to_end(host)
+        else:
+            del self.pending[host]
+        self.waiting -= 1
+
+    def _host(self, source):
+        return urlsplit(source.url).netloc
+
+
+class RetryQueue:
+    '''
+    Holds the sources that failed until their next attempt is due, ordered
+    by time in a heap. The delay doubles with every attempt, starting at
+    `base` seconds and capped at `max_delay`, and half of it is random so
+    retries to the same host spread out. Sources that used up their
+    Source.retries are added to the dead letters instead.
+    '''
+    def __init__(self, dead_letters=None, base=1, max_delay=300):
+        self.dead_letters = dead_letters
+        self.base = base
+        self.max_delay = max_delay
+        self.heap = []
+        self.counter = count()
+        self.lock = Lock()
+
+    def push(self, source, error=''):
+        '''
+        Schedules a retry for the source, returns False if the source has
+        no retries left.
+        '''
+        source.attempts += 1
+        if source.attempts > source.retries:
+            if self.dead_letters:
+                self.dead_letters.add(source, error)
+            return False
+
+        delay = min(self.max_delay, self.base * 2 ** (source.attempts - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        with self.lock:
+            # The counter keeps sources with the same time from being compared.
+            heappush(self.heap, (time.time() + delay, next(self.counter),
+                                 source))
+        return True
+
+    def pop_due(self, now):
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heappop(self.heap)[2])
+        return due
+
+    def next_due(self):
+        with self.lock:
+            return self.heap[0][0] if self.heap else float('inf')
+
+    def clear(self):
+        '''
+        Removes the sources that wait for a retry and returns them.
+        '''
+        with self.lock:
+            cleared = [source for due, i, source in self.heap]
+            self.heap = []
+        return cleared
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class DeadLetters:
+    '''
+    Stores the sources that could not be retrieved as json lines, so they
+    can be inspected and replayed later:
+
+        Phase(sources=DeadLetters('nu.nl_dead_letters').replay())
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.fle = None
+        self.lock = Lock()
+
+    def add(self, source, error=''):
+        letter = {'url': source.url, 'method': source.method,
+                  'params': source.params, 'data': source.data,
+                  'headers': source.headers, 'attempts': source.attempts,
+                  'error': str(error), 'time': time.time()}
+        with self.lock:
+            if not self.fle:
+                self.fle = open(self.path, 'a')
+            self.fle.write(json.dumps(letter, default=str) + '\n')
+            self.fle.flush()
+
+    def read(self):
+        try:
+            with open(self.path) as fle:
+                for line in fle:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def replay(self, **kwargs):
+        '''
+        Yields a fresh Source for every dead letter, the keyword arguments
+        are passed on to the Source.
+        '''
+        from .components import Source
+
+        for letter in self.read():
+            yield Source(url=letter['url'], method=letter['method'],
+                         params=letter['params'], data=letter['data'],
+                         headers=letter['headers'], **kwargs)
+
+    def clear(self):
+        with self.lock:
+            if self.fle:
+                self.fle.close()
+                self.fle = None
+            open(self.path, 'w').close()
+
+
+class InFlight:
+    '''
+    Counts the sources of a crawl from the moment they are queued until
+    they are parsed or dropped. The source workers drop sources from their
+    own threads, so the count only changes while holding the lock.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.lock = Lock()
+
+    def add(self, n=1):
+        with self.lock:
+            self.count += n
+
+    def done(self, n=1):
+        '''
+        Returns True when no sources are left in flight.
+        '''
+        with self.lock:
+            self.count -= n
+            return self.count == 0
+
+    def idle(self):
+        return self.count == 0
+
+
+class ConcurrencyController:
+    '''
+    Adapts the number of requests in flight with additive increase and
+    multiplicative decrease (AIMD). While the responses are healthy the limit
+    grows by `increase` per round of requests. When a host throttles (429,
+    503 or a timeout) or a request takes longer than `latency_factor` times
+    the mean get time of the workers, the limit is multiplied by `decrease`.
+    '''
+    def __init__(self, parent, start=1, minimum=1, maximum=100, increase=1,
+                 decrease=0.5, latency_factor=2):
+        self.parent = parent
+        self.limit = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.last_decrease = 0
+        self.condition = Condition()
+
+    def acquire(self, timeout=1):
+        '''
+        Waits until a request can be made, returns False on a timeout.
+        '''
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None, throttled=False):
+        '''
+        Frees the slot of a finished request and adjusts the limit based on
+        how the request went. Without a latency the limit is left alone.
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            if latency is not None:
+                mean = self._mean_latency()
+                if throttled or (mean and
+                                 latency > self.latency_factor * mean):
+                    # Only back off once per round trip, all the requests in
+                    # flight were probably hit by the same problem.
+                    now = time.time()
+                    if now - self.last_decrease > (mean or latency):
+                        self.limit = max(self.minimum,
+                                         self.limit * self.decrease)
+                        self.last_decrease = now
+                else:
+                    self.limit = min(self.maximum,
+                                     self.limit + self.increase / self.limit)
+            self.condition.notify_all()
+
+    def _mean_latency(self):
+        visited = sum(w.visited for w in self.parent.workers)
+        if visited:
+            return sum(w.total_time for w in self.parent.workers) / visited
+        return 0
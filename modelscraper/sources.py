@@ -1,11 +1,27 @@
+from queue import Empty
 from threading import Thread
+import asyncio
 import time
 from user_agent import generate_user_agent
 import requests
 import subprocess
 
+from . import metrics
+from .cache import fingerprint
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 
 class BaseSourceWorker(Thread):
+    # Whether a single worker makes multiple requests at the same time.
+    concurrent = False
+    # Whether the worker visits the host of the url, the HostScheduler only
+    # keeps a delay and a concurrency per host for those workers.
+    per_host = True
+
     def __init__(self, parent=None, id=0, stop_event=None):
         super().__init__()
         if parent:
@@ -13,7 +29,11 @@ class BaseSourceWorker(Thread):
             self.in_q = parent.source_q
             self.out_q = parent.parse_q
             self.parent = parent
+            self.scheduler = parent.scheduler
+            self.controller = parent.controller
             self.stop_event = stop_event
+        self.throttled = False
+        self.requested = True
         self.mean = 0
         self.total_time = 0
         self.visited = 0
@@ -24,19 +44,52 @@ class BaseSourceWorker(Thread):
     def run(self):
         print('started')
         while not self.stop_event.wait(0):
+            if self.controller and not self.controller.acquire():
+                continue
+            try:
+                source = self.scheduler.get()
+            except Empty:
+                if self.controller:
+                    self.controller.release()
+                continue
             start = time.time()
-            source = self.retrieve(self.in_q.get())
-            if source:
-                self.out_q.put(source)
+            self.throttled = False
+            self.requested = True
+            retrieved = None
+            try:
+                retrieved = self.retrieve(source)
+            except Exception as E:
+                # Otherwise the source would stay in flight forever.
+                print('Failed to retrieve', source.url, E)
+                self.parent.source_dropped(source)
+            finally:
+                self.scheduler.done(source, self.requested)
+                took = time.time() - start
+                metrics.fetch_seconds.observe(took)
+                if self.controller:
+                    self.controller.release(took, self.throttled)
+            if retrieved:
+                metrics.fetched.inc()
+                self.out_q.put(retrieved)
             self.visited += 1
             self.total_time += time.time() - start
             self.mean = self.total_time / self.visited
-            self.in_q.task_done()
         print('Done')
 
     def retrieve(self):
         raise NotImplementedError
 
+    def retry(self, source, error=''):
+        '''
+        Schedules the source for another attempt, or drops it when it has
+        no retries left.
+        '''
+        if self.parent.retries.push(source, error):
+            metrics.retried.inc()
+        else:
+            print('giving up on', source.url)
+            self.parent.source_dropped(source)
+
 
 class WebSource(BaseSourceWorker):
     '''
@@ -44,55 +97,284 @@ class WebSource(BaseSourceWorker):
     It will place all items in its queue into the out_q specified.
     For use without parent Thread supply keyword arguments: name, domain, in_q,
     '''
-    def __init__(self, time_out=0.3, retries=10, **kwargs):
+    # Status codes with which a server tells us to slow down.
+    throttle_codes = (429, 503)
+
+    def __init__(self, retries=10, **kwargs):
         super().__init__(**kwargs)
         self.domain = self.parent.model.domain
         self.name = self.parent.name + 'WebSource ' + str(self.id)
         self.retries = retries
         self.session = self.parent.model.session
-        self.time_out = time_out
+        self.cache = self.parent.cache
+        self.recorder = self.parent.recorder
         self.times = []
-        self.to_parse = self.parent.to_parse
         self.user_agent = self.parent.model.user_agent
 
         self.connection_errors = []
 
-    def retrieve(self, source):
+    def _headers(self, source):
         headers = {'User-Agent': generate_user_agent()
                     if not self.user_agent else self.user_agent}
+        return {**headers, **source.headers} # noqa
+
+    def _cache_lookup(self, source, headers):
+        '''
+        Returns the fingerprint and the cached entry of the source. When the
+        entry has to be revalidated the conditional headers are added.
+        '''
+        if not (self.cache or self.recorder):
+            return None, None
+        key = fingerprint(source.method, source.url, source.params,
+                          source.data)
+        entry = self.cache.get(key) if self.cache else None
+        if entry and not entry.fresh:
+            headers.update(entry.validators())
+        return key, entry
+
+    def _from_cache(self, source, entry):
+        if source.parse:
+            source.data = entry.body
+            return source
+        self.parent.source_dropped(source)
+
+    def retrieve(self, source):
+        headers = self._headers(source)
+        key, entry = self._cache_lookup(source, headers)
+        if entry and entry.fresh:
+            self.requested = False
+            return self._from_cache(source, entry)
 
         try:
             func = getattr(self.session, source.method)
+            started = time.time()
             page = func(source.url, data=source.data,
                         params=source.params,
-                        headers={**headers, # noqa
-                                    **source.headers})
+                        headers=headers)
+            # A 304 carries no body, the cached one is used instead.
+            if self.recorder and page.status_code != 304:
+                self.recorder.record(
+                    key, source.method, page.request.url,
+                    page.request.headers, page.request.body,
+                    page.status_code, page.reason, page.headers,
+                    page.content, started, page.elapsed.total_seconds())
+            self.throttled = page.status_code in self.throttle_codes
             # print(id(self), '{}'.format(source.url), page, source.method, source.data)
 
-            if page and source.parse:
+            if self.throttled:
+                self.retry(source, page.status_code)
+            elif page.status_code == 304 and entry:
+                self.cache.refresh(key, page.headers)
+                return self._from_cache(source, entry)
+            elif page and source.parse:
+                if self.cache:
+                    self.cache.put(key, source.url, page.headers,
+                                   page.content)
                 source.data = page.content
                 return source
             else:
                 print(source.url)
                 print(page)
                 print('No parsing required')
+                self.parent.source_dropped(source)
 
-            time.sleep(self.time_out)
         # Retry later with a timeout,
-        except requests.Timeout:
+        except requests.Timeout as E:
             print('timeout')
-            self.in_q.put(source)
+            self.throttled = True
+            self.retry(source, E)
 
         # Retry later with connection error.
-        except requests.ConnectionError:
+        except requests.ConnectionError as E:
             print('connection error')
-            self.in_q.put(source)
+            self.retry(source, E)
+
+        except Exception as E:
+            print(E)
+            self.parent.source_dropped(source)
+
+class AsyncWebSource(WebSource):
+    '''
+    A downloader that keeps many requests in flight from a single thread by
+    running them on an asyncio event loop. Like the other source workers it
+    takes sources from the in_q and places the downloaded ones in the out_q.
+    The number of simultaneous requests per worker is set by
+    Phase.concurrency, so a single worker is usually enough. Without a
+    ScrapeModel.host_delay the time_out between the requests to a host is
+    divided by the concurrency, so it does not cap the requests in flight.
+    '''
+    concurrent = True
+
+    def __init__(self, **kwargs):
+        if aiohttp is None:
+            raise ImportError('The AsyncWebSource requires aiohttp.')
+        super().__init__(**kwargs)
+        self.concurrency = self.parent.phase.concurrency
+
+    def run(self):
+        print('started')
+        asyncio.run(self._run())
+        print('Done')
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(
+                connector=connector,
+                cookies=self.session.cookies.get_dict()) as session:
+            while not self.stop_event.is_set():
+                await semaphore.acquire()
+                if self.controller and not await loop.run_in_executor(
+                        None, self.controller.acquire):
+                    semaphore.release()
+                    continue
+                # The scheduler blocks, so wait for it outside of the loop.
+                source = await loop.run_in_executor(None, self._next_source)
+                if source is None:
+                    if self.controller:
+                        self.controller.release()
+                    semaphore.release()
+                    continue
+
+                task = loop.create_task(
+                    self._fetch(session, source, semaphore))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks)
 
-            time.sleep(self.time_out)
+    def _next_source(self):
+        try:
+            return self.scheduler.get()
+        except Empty:
+            return None
+
+    async def _fetch(self, session, source, semaphore):
+        start = time.time()
+        throttled = False
+        requested = True
+        try:
+            retrieved, throttled, requested = await self.retrieve_async(
+                session, source)
+            if retrieved:
+                metrics.fetched.inc()
+                self.out_q.put(retrieved)
+        except Exception as E:
+            print('Failed to retrieve', source.url, E)
+            self.parent.source_dropped(source)
+        finally:
+            metrics.fetch_seconds.observe(time.time() - start)
+            self.scheduler.done(source, requested)
+            if self.controller:
+                self.controller.release(time.time() - start, throttled)
+            semaphore.release()
+            self.visited += 1
+            self.total_time += time.time() - start
+            self.mean = self.total_time / self.visited
+
+    async def retrieve_async(self, session, source):
+        '''
+        Returns the retrieved source, or None, whether the server throttled
+        the request and whether a request was sent at all.
+        '''
+        # The cache and the recorder block on the disk, they run in the
+        # executor so the other requests in flight keep going.
+        loop = asyncio.get_running_loop()
+        headers = self._headers(source)
+        key, entry = await loop.run_in_executor(None, self._cache_lookup,
+                                                source, headers)
+        if entry and entry.fresh:
+            return await loop.run_in_executor(None, self._from_cache, source,
+                                              entry), False, False
+
+        try:
+            func = getattr(session, source.method)
+            started = time.time()
+            async with func(source.url, data=source.data or None,
+                            params=source.params,
+                            headers=headers) as page:
+                content = await page.read()
+                if self.recorder and page.status != 304:
+                    await loop.run_in_executor(
+                        None, self.recorder.record,
+                        key, source.method, str(page.url),
+                        page.request_info.headers, source.data or None,
+                        page.status, page.reason, page.headers, content,
+                        started, time.time() - started)
+                throttled = page.status in self.throttle_codes
+                if throttled:
+                    self.retry(source, page.status)
+                elif page.status == 304 and entry:
+                    await loop.run_in_executor(None, self.cache.refresh, key,
+                                               page.headers)
+                    return await loop.run_in_executor(
+                        None, self._from_cache, source, entry), False, True
+                elif page.status < 400 and source.parse:
+                    if self.cache:
+                        await loop.run_in_executor(
+                            None, self.cache.put, key, source.url,
+                            page.headers, content)
+                    source.data = content
+                    return source, throttled, True
+                else:
+                    print(source.url)
+                    print(page.status)
+                    print('No parsing required')
+                    self.parent.source_dropped(source)
+                return None, throttled, True
+
+        # Retry later with a timeout,
+        except asyncio.TimeoutError:
+            print('timeout')
+            self.retry(source, 'timeout')
+            return None, True, True
+
+        # Retry later with connection error.
+        except aiohttp.ClientConnectionError as E:
+            print('connection error')
+            self.retry(source, E)
 
         except Exception as E:
             print(E)
-            self.to_parse -= 1
+            self.parent.source_dropped(source)
+        return None, False, True
+
+
+class ReplaySource(BaseSourceWorker):
+    '''
+    Serves the sources from a recorded crawl instead of the network, so the
+    parsing and storing of a model can be run at disk speed. The recording
+    is set with ScrapeModel(replay=path), where path is a WARC file, a
+    directory of WARC files or a response cache directory.
+    Sources that are not in the recording are dropped.
+    '''
+    per_host = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.name = self.parent.name + 'ReplaySource ' + str(self.id)
+        self.archive = self.parent.archive
+        if self.archive is None:
+            raise ValueError('The ReplaySource needs a recording, set it '
+                             'with ScrapeModel(replay=path).')
+
+    def retrieve(self, source):
+        key = fingerprint(source.method, source.url, source.params,
+                          source.data)
+        data = self.archive.body(key)
+        if data is None:
+            print('Not in the recording', source.url)
+            self.parent.source_dropped(source)
+        elif source.parse:
+            source.data = data
+            return source
+        else:
+            self.parent.source_dropped(source)
+
 
 #TODO fix the FileWorker class to the new spec.
 class FileWorker(Thread):
@@ -108,6 +390,8 @@ class FileWorker(Thread):
 
 
 class ProgramSource(BaseSourceWorker):
+    per_host = False
+
     def __init__(self, function='', *args, **kwargs):
         print(kwargs)
         super().__init__(*args, **kwargs)
@@ -0,0 +1,115 @@
+from fnmatch import translate
+from functools import lru_cache
+import re
+
+
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+URL = re.compile(r'(https?)://([^/?#]*)([^?#]*)(?:\?([^#]*))?(?:#(.*))?',
+                 re.I | re.S).fullmatch
+
+
+class Canonicalizer:
+    '''
+    Rewrites urls to one form before they are checked against the seen
+    filter and queued, so the same page is not fetched twice under
+    different urls. The scheme and the host are lowercased, the host loses
+    its default port, the user info and the path keep their case,
+    the fragment is dropped, as are the query parameters matching one of
+    `drop_params` (glob patterns), and the remaining parameters are sorted.
+
+    It is off by default, so the urls and dedup keys of existing models do
+    not change. The rules are set per ScrapeModel, True uses the defaults:
+
+        ScrapeModel(canonicalize={'drop_params': ('utm_*', 'sessionid')})
+
+    key() gives the url under which a page is deduplicated, it also ignores
+    the scheme and a trailing slash.
+    '''
+    def __init__(self, drop_params=('utm_*',), sort_params=True,
+                 keep_fragment=False, strip_www=False):
+        self.drop = None
+        if drop_params:
+            self.drop = re.compile('|'.join(translate(p)
+                                            for p in drop_params)).match
+        self.sort_params = sort_params
+        self.keep_fragment = keep_fragment
+        self.strip_www = strip_www
+        self._host = lru_cache(maxsize=4096)(self._host)
+
+    def __call__(self, url):
+        match = self._match(url)
+        if not match:
+            return url
+        scheme, host, path, query, fragment = self._split(match)
+        url = scheme + '://' + host + path
+        if query:
+            url += '?' + query
+        if fragment:
+            url += '#' + fragment
+        return url
+
+    def key(self, url):
+        match = self._match(url)
+        if not match:
+            return url
+        scheme, host, path, query, fragment = self._split(match)
+        key = host + path.rstrip('/')
+        if query:
+            key += '?' + query
+        if fragment:
+            key += '#' + fragment
+        return key
+
+    def _match(self, url):
+        if not isinstance(url, str):
+            raise TypeError('A url should be a string, not {!r}'.format(url))
+        return URL(url)
+
+    def _split(self, match):
+        scheme, netloc, path, query, fragment = match.groups()
+        scheme = scheme.lower()
+        netloc = self._host(scheme, netloc)
+        if query:
+            query = self._query(query)
+        if not self.keep_fragment:
+            fragment = None
+        return scheme, netloc, path or '/', query, fragment
+
+    def _host(self, scheme, netloc):
+        # The user info is case sensitive, only the host is lowercased.
+        userinfo, at, host = netloc.rpartition('@')
+        host = host.lower()
+        port = DEFAULT_PORTS.get(scheme)
+        if port and host.endswith(port):
+            host = host[:-len(port)]
+        if self.strip_www and host.startswith('www.'):
+            host = host[4:]
+        return userinfo + at + host
+
+    def _query(self, query):
+        params = [param for param in query.split('&') if param]
+        if self.drop:
+            params = [param for param in params
+                      if not self.drop(param.split('=', 1)[0])]
+        if self.sort_params:
+            params.sort()
+        return '&'.join(params)
+
+
+def canonicalizer(rules):
+    '''
+    Creates the Canonicalizer for the `canonicalize` argument of a
+    ScrapeModel: True for the default rules, a dict of rules or a
+    Canonicalizer. Returns None for False or None, the urls are then left
+    as they are.
+    '''
+    if rules is None or rules is False:
+        return None
+    if isinstance(rules, Canonicalizer):
+        return rules
+    if rules is True:
+        return Canonicalizer()
+    if isinstance(rules, dict):
+        return Canonicalizer(**rules)
+    raise TypeError('canonicalize should be True, False, a dict of rules or '
+                    'a Canonicalizer, not {!r}'.format(rules))
@@ -0,0 +1,295 @@
+from datetime import datetime, timezone
+from mmap import mmap, ACCESS_READ
+from queue import Queue
+from threading import Thread
+from urllib.parse import urlsplit
+import gzip
+import json
+import os
+import time
+import uuid
+import zlib
+
+from .cache import ResponseCache, fingerprint
+
+
+def open_archive(path):
+    '''
+    Opens a recorded crawl for replaying. The path can be a WARC file, a
+    directory with WARC files or the directory of a ResponseCache.
+    '''
+    if os.path.isdir(path):
+        warcs = sorted(os.path.join(path, f) for f in os.listdir(path)
+                       if f.endswith(('.warc', '.warc.gz')))
+        if not warcs:
+            return ResponseCache(path, max_size=float('inf'))
+        return WarcArchive(warcs)
+    return WarcArchive([path])
+
+
+def parse_record(record):
+    '''
+    Splits a WARC record in its headers and content.
+    '''
+    head, _, rest = record.partition(b'\r\n\r\n')
+    lines = head.decode('utf8', 'replace').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', len(rest)))
+    return headers, rest[:length]
+
+
+def parse_http_response(content):
+    '''
+    Returns the status, headers and the decoded body of a HTTP response.
+    '''
+    head, _, body = content.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = _dechunk(body)
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        body = zlib.decompress(body)
+    return status, headers, body
+
+
+def _dechunk(body):
+    chunks = []
+    while body:
+        size, _, body = body.partition(b'\r\n')
+        size = int(size.split(b';')[0], 16)
+        if not size:
+            break
+        chunks.append(body[:size])
+        body = body[size + 2:]
+    return b''.join(chunks)
+
+
+class WarcArchive:
+    '''
+    Gives O(1) access to the responses in WARC files. The files are memory
+    mapped and an index from request fingerprint to the offset and length of
+    each record is built on the first use. The index is kept next to the
+    archive, so it does not have to be built again.
+    Records written by the WarcWriter carry a WARC-Fingerprint header, for
+    other archives the fingerprint of a GET request to the target uri is
+    used.
+    '''
+    def __init__(self, paths):
+        self.maps = []
+        self.index = {}
+        for i, path in enumerate(paths):
+            with open(path, 'rb') as fle:
+                self.maps.append((mmap(fle.fileno(), 0, access=ACCESS_READ),
+                                  path.endswith('.gz')))
+            for key, offset, length in self._load_index(path, i):
+                self.index[key] = (i, offset, length)
+
+    def body(self, key):
+        '''
+        Returns the body of the response for the fingerprint or None.
+        '''
+        response = self.response(key)
+        if response:
+            return response[2]
+
+    def response(self, key):
+        if key not in self.index:
+            return None
+        i, offset, length = self.index[key]
+        data, compressed = self.maps[i]
+        record = data[offset:offset + length]
+        if compressed:
+            record = zlib.decompress(record, 16 + zlib.MAX_WBITS)
+        return parse_http_response(parse_record(record)[1])
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _load_index(self, path, i):
+        index_path = path + '.idx'
+        if os.path.exists(index_path) and \
+                os.path.getmtime(index_path) >= os.path.getmtime(path):
+            with open(index_path) as fle:
+                return [json.loads(line) for line in fle]
+
+        index = list(self._build_index(*self.maps[i]))
+        try:
+            with open(index_path, 'w') as fle:
+                for entry in index:
+                    fle.write(json.dumps(entry) + '\n')
+        except OSError:
+            print('Could not write the index', index_path)
+        return index
+
+    def _build_index(self, data, compressed):
+        offset = 0
+        while offset < len(data):
+            if compressed:
+                record, length = self._read_member(data, offset)
+            else:
+                record, length = self._read_plain(data, offset)
+            headers, _ = parse_record(record)
+
+            if headers.get('warc-type') == 'response':
+                key = headers.get('warc-fingerprint') or \
+                    fingerprint('get', headers.get('warc-target-uri', ''))
+                yield key, offset, length
+            offset += length
+
+    def _read_member(self, data, offset, chunk_size=2 ** 16):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        record = []
+        position = offset
+        while not decompressor.eof and position < len(data):
+            chunk = data[position:position + chunk_size]
+            record.append(decompressor.decompress(chunk))
+            position += len(chunk)
+        length = position - offset - len(decompressor.unused_data)
+        return b''.join(record), length
+
+    def _read_plain(self, data, offset):
+        end = data.find(b'\r\n\r\n', offset)
+        headers, _ = parse_record(data[offset:end + 4])
+        length = end + 4 - offset + int(headers.get('content-length', 0))
+        # Records are followed by two newlines.
+        return data[offset:offset + length], length + 4
+
+
+class WarcWriter(Thread):
+    '''
+    Records the responses of a crawl in WARC files from a thread of its own,
+    so the source workers never wait for the disk. Every request and
+    response is written as a separate gzip member together with an index
+    for the WarcArchive, and a new file is started after `max_size` bytes.
+    At most `queue_size` responses wait in memory to be written.
+    '''
+    # The bodies are stored decoded, so these headers no longer apply.
+    skip_headers = ('content-encoding', 'transfer-encoding',
+                    'content-length')
+
+    def __init__(self, path, prefix='crawl', max_size=2 ** 30,
+                 queue_size=1000):
+        super().__init__(daemon=True)
+        self.path = path
+        self.prefix = prefix
+        self.max_size = max_size
+        self.q = Queue(maxsize=queue_size)
+        self.fle = None
+        self.index = None
+        self.n_files = 0
+        os.makedirs(path, exist_ok=True)
+
+    def record(self, key, method, url, request_headers, request_body,
+               status, reason, headers, body, started, elapsed):
+        self.q.put((key, method, url, request_headers, request_body, status,
+                    reason, headers, body, started, elapsed))
+
+    def stop(self):
+        self.q.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                break
+            self._write_exchange(*item)
+        self._close()
+
+    def _write_exchange(self, key, method, url, request_headers,
+                        request_body, status, reason, headers, body, started,
+                        elapsed):
+        if not self.fle or self.fle.tell() > self.max_size:
+            self._rotate()
+
+        date = datetime.fromtimestamp(started, timezone.utc).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+        request_id = self._record_id()
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        request = '{} {} HTTP/1.1\r\n'.format(method.upper(), target)
+        request += ''.join('{}: {}\r\n'.format(name, value)
+                           for name, value in request_headers.items())
+        request = request.encode('latin-1', 'replace') + b'\r\n'
+        if request_body:
+            if isinstance(request_body, str):
+                request_body = request_body.encode('utf8')
+            request += request_body
+        self._write_record('request', url, date, request_id, request,
+                           {'WARC-Fingerprint': key})
+
+        response = 'HTTP/1.1 {} {}\r\n'.format(status, reason or '')
+        response += ''.join('{}: {}\r\n'.format(name, value)
+                            for name, value in headers.items()
+                            if name.lower() not in self.skip_headers)
+        response += 'Content-Length: {}\r\n\r\n'.format(len(body))
+        response = response.encode('latin-1', 'replace') + body
+        offset = self.fle.tell()
+        self._write_record('response', url, date, self._record_id(),
+                           response,
+                           {'WARC-Fingerprint': key,
+                            'WARC-Concurrent-To': request_id,
+                            'WARC-Fetch-Time': '{:.3f}'.format(elapsed)})
+        self.index.write(json.dumps([key, offset,
+                                     self.fle.tell() - offset]) + '\n')
+
+    def _write_record(self, warc_type, url, date, record_id, content,
+                      extra_headers={}):
+        headers = [('WARC-Type', warc_type),
+                   ('WARC-Record-ID', record_id),
+                   ('WARC-Date', date)]
+        if url:
+            headers.append(('WARC-Target-URI', url))
+        headers.extend(extra_headers.items())
+        if warc_type in ('request', 'response'):
+            headers.append(('Content-Type', 'application/http; msgtype=' +
+                            warc_type))
+        else:
+            headers.append(('Content-Type', 'application/warc-fields'))
+        headers.append(('Content-Length', len(content)))
+
+        head = 'WARC/1.0\r\n' + ''.join('{}: {}\r\n'.format(*h)
+                                        for h in headers) + '\r\n'
+        self.fle.write(gzip.compress(head.encode('utf8') + content +
+                                     b'\r\n\r\n', compresslevel=6))
+
+    def _rotate(self):
+        self._close()
+        name = '{}-{}-{:05d}.warc.gz'.format(
+            self.prefix, time.strftime('%Y%m%d%H%M%S'), self.n_files)
+        self.n_files += 1
+        self.fle = open(os.path.join(self.path, name), 'wb')
+        self.index = open(os.path.join(self.path, name + '.idx'), 'w')
+        info = 'software: modelscraper\r\nformat: WARC File Format 1.0\r\n'
+        self._write_record('warcinfo', '', time.strftime(
+            '%Y-%m-%dT%H:%M:%SZ', time.gmtime()), self._record_id(),
+            info.encode('utf8'))
+
+    def _close(self):
+        if self.fle:
+            self.fle.close()
+            # The index is closed last so it is never older than the archive.
+            self.index.close()
+
+    def _record_id(self):
+        return '<urn:uuid:{}>'.format(uuid.uuid4())
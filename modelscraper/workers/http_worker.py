@@ -21,7 +21,7 @@ class WebSource(Thread):
             self.out_q = parent.parse_q
             self.retries = retries
             self.session = parent.model.session
-            self.to_parse = parent.to_parse
+            self.parent = parent
             self.user_agent = parent.user_agent
             self.time_out = time_out
             self.times = []
@@ -82,5 +82,5 @@ class WebSource(Thread):
 
             except Exception as E:
                 print(E)
-                self.to_parse -= 1
+                self.parent.source_dropped(source)
             self.in_q.task_done()
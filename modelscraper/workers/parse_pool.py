@@ -0,0 +1,95 @@
+from multiprocessing import get_context
+import time
+
+from ..helpers import apply_src_template
+
+
+# The parsers of a parse process per phase index, created by init_parsers.
+_parsers = {}
+
+
+class ParseContext:
+    '''
+    Takes the place of the ScrapeWorker as the parent of a parser inside a
+    parse process. The sources the parser creates are collected, so the
+    ScrapeWorker can add them and keep its accounting and seen urls right.
+    '''
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.new_sources = []
+        self.added = []
+        self.reset = False
+        self.parse_times = []
+
+    def _add_source(self, source):
+        self.added.append(source)
+
+    def _apply_src_template(self, source, url):
+        return apply_src_template(source, url)
+
+    def reset_source_queue(self):
+        self.reset = True
+
+    def template_parsed(self, name, seconds):
+        self.parse_times.append((name, seconds))
+
+    def collect(self):
+        collected = (self.new_sources, self.added, self.reset,
+                     self.parse_times)
+        self.new_sources = []
+        self.added = []
+        self.reset = False
+        self.parse_times = []
+        return collected
+
+
+def init_parsers(phases, name, model):
+    for index, (parser_class, templates) in phases.items():
+        _parsers[index] = parser_class(parent=ParseContext(name, model),
+                                       templates=templates)
+
+
+def parse(index, source):
+    '''
+    Parses a source of the phase in a parse process. Returns the objects to
+    store, the sources the parser created, whether the source queue should
+    be reset, the parse time per template and the time it took.
+    '''
+    parser = _parsers[index]
+    start = time.time()
+    objects = list(parser.parse(source))
+    return (objects, *parser.parent.collect(), time.time() - start)
+
+
+class ParsePool:
+    '''
+    A pool of processes that have a parser for every phase in `phases`, a
+    dict of phase index to (parser class, templates). The ScrapeWorker
+    creates it once, before it starts any thread and before a parser in
+    this process prepares the templates. Forking later could copy a lock
+    held by another thread into the processes, and the templates as they
+    are at that moment. The pool has the largest n_parsers of the phases.
+    '''
+    def __init__(self, n_parsers, phases, name, model):
+        self.n_parsers = n_parsers
+        self.pool = get_context('fork').Pool(
+            n_parsers, initializer=init_parsers,
+            initargs=(phases, name, model))
+
+    def submit(self, index, source, done=None):
+        '''
+        Parses the source in a parse process. The `done` Event is set once
+        the result is ready.
+        '''
+        def callback(result):
+            if done:
+                done.set()
+
+        return self.pool.apply_async(parse, (index, source),
+                                     callback=callback,
+                                     error_callback=callback)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -1,131 +1,144 @@
-from collections import defaultdict
+from ast import literal_eval
+from collections import defaultdict, deque
+from itertools import islice
 from multiprocessing import Process
 from threading import Event
 from queue import Queue, Empty
+import operator
 import os
+import re
+import sys
 
 from pybloom import ScalableBloomFilter
 
-from .. import databases
-
-
-class ScrapeWorker(Process):
-    def __init__(self, model, dummy=False):
-        super(ScrapeWorker, self).__init__()
-
+from .. import databases, metrics
+from ..databases.store_worker import FLUSH, SYNC, first
+from ..helpers import (apply_src_template, load_filter, save_filter,
+                       str_as_tuple)
+from .parse_pool import ParsePool
+from ..cache import ResponseCache
+from ..frontier import Frontier
+from ..progress import ProgressReporter
+from ..records import RecordWriter
+from ..urls import canonicalizer
+from ..warc import WarcWriter, open_archive
+from ..scheduling import (ConcurrencyController, DeadLetters, HostScheduler,
+                          InFlight, RetryQueue)
+
+
+CONDITION = re.compile(r'\s*(==|!=|<=|>=|<|>)\s*(.+?)\s*$')
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<=': operator.le,
+             '>=': operator.ge, '<': operator.lt, '>': operator.gt}
+
+
+def _condition_holds(value, cond):
+    '''
+    Compares a value to a condition such as '> 2'. Values are converted to
+    numbers when they are compared to one.
+    '''
+    match = CONDITION.match(cond)
+    if not match:
+        raise ValueError('Unsupported source condition: {!r}'.format(cond))
+    op, operand = match.groups()
+    operand = literal_eval(operand)
+    if isinstance(operand, (int, float)) and not isinstance(value, (int, float)):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+    return OPERATORS[op](value, operand)
+
+
+class WakeupQueue(Queue):
+    '''
+    A Queue that sets an Event when something is put on it, so one thread
+    can wait for the queues of several stages at once.
+    '''
+    def __init__(self, wakeup):
+        super().__init__()
+        self.wakeup = wakeup
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.wakeup.set()
+
+
+class PhaseRunner:
+    '''
+    Runs the source workers and the parser of a single phase: it queues the
+    sources, parses the downloaded ones, stores the objects and adds the
+    sources they lead to. The ScrapeWorker runs the phases one by one as a
+    runner itself, when the phases are pipelined every phase runs in a
+    PhaseStage.
+    A runner sets its state with _init_runner and needs the model, name,
+    pool, cache, recorder, archive, canonical, seen, forwarded, dbs,
+    templates and writers of the ScrapeWorker.
+    '''
+    def _init_runner(self, dead_letters, hosts=None, wakeup=None):
+        '''
+        Sets the state of a single phase that the methods of the runner
+        work on. A runner that reuses the state of another one overrides
+        the attributes afterwards. The `wakeup` Event is set when a source
+        is downloaded, dropped or parsed by the parse pool.
+        '''
         self.source_q = Queue()
-        self.parse_q = Queue()
-        self.seen = ScalableBloomFilter()
-        self.forwarded = ScalableBloomFilter()
-        self.new_sources = []
-        self.workers = []
-        self.to_forward = []
+        self.parse_q = WakeupQueue(wakeup) if wakeup else Queue()
+        self.wakeup = wakeup
+        self.retries = RetryQueue(dead_letters)
+        # The delay between the requests to a host is set per phase.
+        self.scheduler = HostScheduler(self.source_q,
+                                       concurrency=self.model.host_concurrency,
+                                       retries=self.retries, hosts=hosts)
+        self.in_flight = InFlight()
+        self.phase = None
+        self.phase_index = 0
         self.parser = None
-        self.done_parsing = False
-        self.no_more_sources = False
-        self.dbs = dict()
-        self.schedule = model.schedule
-        self.model = model
+        self.parse_pool = None
+        self.controller = None
         self.source_kill = None
-        self.dummy = dummy
-
-        db_threads = defaultdict(list)
-
-        # Check if the functions in each template are used properly
-        # and store which types of databases are needed.
-        for phase in self.model.phases:
-            for template in phase.templates:
-                self.check_functions(template, phase)
-                if template.db_type:
-                    db_threads[template.db_type].append(template)
-
-        # Start all the threads necessary for storing the data and give each
-        # template a reference to the thread it needs to store data in.
-        for thread, templates in db_threads.items():
-            if not dummy:
-                store_thread = databases._threads[thread]()
-            else:
-                store_thread = databases._threads['dummy']()
-
-            for template in templates:
-                self.dbs[template.name] = store_thread
-            store_thread.start()
-
-    def run(self):
-        # create the threads needed to scrape
-        i = 0
-        while i < len(self.model.phases):
-            # if self.is_scheduled():
-            phase = self.model.phases[i]
-            print('running phase:', i, phase.name)
-
-            # Check if the phase has a parser, if not, reuse the one from the
-            # last phase.
-            self.to_parse = 0
-            self.parsed = 0
-
-            if phase.active:
-                self.spawn_workforce(phase)
-                self.add_sources(phase)
-                self.to_forward = []
-                self.parse_sources()
-
-            if not phase.repeat:
-                i += 1
-        for db in self.dbs.values():
-            db.store_q.put(None)
-        for db in self.dbs.values():
-            db.store_q.join()
-        print('Waiting for the database')
-        print('Scraper fully stopped')
-
-    def parse_sources(self):
-        while True:
-            if self.to_parse == self.parsed:
-                break
-            try:
-                source = self.parse_q.get(timeout=10)
-            except Empty:
-                if self.source_q.empty():
-                    print('No more sources to parse at this point')
-                    break
-                # elif self.paused:
-                #     time.sleep(self.get_sleep_time())
-                else:
-                    print('Waiting for sources to parse')
-                    source = None
-
-            if source is not None:
-                self.seen.add(source.url)
-                objects = self.parser.parse(source)
-                self.parsed += 1
-
-                for obj in objects:
-                    if obj.db:
-                        self.dbs[obj.name].store_q.put(obj)
-
-                for new_source in self.new_sources:
-                    self._gen_source(*new_source)
-
-                self.new_sources = []
-                self.show_progress()
-
-        print('Unparsed ', self.source_q.qsize())
+        self.workers = []
+        self.new_sources = []
+        self.to_forward = []
+        self.phase_sources = iter(())
+        self.sources_exhausted = True
+        self.frontier_size = 0
+        self.frontier = None
+        self.parsed = 0
+        self.taken = 0
 
     def spawn_workforce(self, phase):
         # check if phase reuses the current source workforce
         if phase.parser:
-            self.parser = phase.parser(parent=self, templates=phase.templates)
-        elif not self.parser and not phase.parser:
+            parser_class = phase.parser
+        elif not self.parser:
             raise Exception('No parser was specified')
         else:
-            parse_class = self.parser.__class__
-            self.parser = parse_class(parent=self, templates=phase.templates)
+            parser_class = self.parser.__class__
+
+        # The processes of the pool prepared their own copy of the
+        # templates when they started.
+        self.parse_pool = self.pool if phase.n_parsers > 1 else None
+
+        self.parser = parser_class(parent=self, templates=phase.templates)
 
         if phase.n_workers:
             n_workers = phase.n_workers
         else:
             n_workers = self.model.num_getters
+        # The delay follows the configured workers, not the ones that are
+        # started for the controller below.
+        self.scheduler.delay = self._host_delay(phase, n_workers)
+        self.scheduler.per_host = phase.source_worker.per_host
+
+        # Let the controller find the amount of requests in flight, starting
+        # from the amount of workers. Workers that make one request at a
+        # time are all started so the limit has room to grow.
+        self.controller = None
+        if phase.adaptive:
+            self.controller = ConcurrencyController(
+                self, start=n_workers, maximum=phase.concurrency)
+            if not phase.source_worker.concurrent:
+                n_workers = phase.concurrency
 
         # Kill existing workers if there are any
         if self.workers:
@@ -139,31 +152,116 @@ class ScrapeWorker(Process):
         for worker in self.workers:
             worker.start()
 
-    def add_sources(self, phase):
-        urls_in_db = []
-        if phase.synchronize:
-            urls_in_db = [url for url in self.get_scraped_urls(phase)]
+    def stop_workers(self):
+        '''
+        Stops the source workers and waits until they exited.
+        '''
+        if self.source_kill:
+            self.source_kill.set()
+        for worker in self.workers:
+            worker.join()
 
-        for source in self.to_forward:
-            if source.url not in urls_in_db:
-                self.source_q.put(source)
-                self.to_parse += 1
+    def _host_delay(self, phase, n_workers):
+        '''
+        The seconds between two requests to a host. Without
+        ScrapeModel.host_delay the time_out is divided by the number of
+        requests the workers of the phase make at once, so the phase is as
+        fast as when every worker slept time_out after its request.
+        '''
+        if self.model.host_delay is not None:
+            return self.model.host_delay
+        slots = n_workers
+        if phase.source_worker.concurrent:
+            slots *= phase.concurrency
+        return self.model.time_out / max(slots, 1)
+
+    def _fill_frontier(self):
+        '''
+        Tops up the source queue with the sources of the phase once it has
+        drained to half the frontier size of the phase.
+        '''
+        if self.sources_exhausted or \
+                self.scheduler.qsize() > self.frontier_size // 2:
+            return
+        while self.scheduler.qsize() < self.frontier_size:
+            try:
+                source = next(self.phase_sources)
+            except StopIteration:
+                self.sources_exhausted = True
+                return
+            self.taken += 1
+            if source is not None:
+                self._enqueue(source)
 
-        for source in phase.sources:
-            if source.from_db:
-                sources = self.dbs[source.from_db].read(source.from_db)
-            if source.active:
-                self.source_q.put(source)
-                self.to_parse += 1
+    def _enqueue(self, source):
+        self.in_flight.add()
+        if self.frontier:
+            self.frontier.add(source, self.phase_index)
+        self.source_q.put(source)
 
-    def get_scraped_urls(self, phase):
-        for template in phase.templates:
-            if template.name in self.dbs:
-                for objct in self.dbs[template.name].read(template):
-                    if objct:
-                        yield objct.attrs['url'].value
+    def _parse(self, source, pending):
+        '''
+        Parses the source, or hands it to the parse pool and adds it to the
+        pending results.
+        '''
+        self.seen.add(self._url_key(source.url))
+        if self.parse_pool:
+            pending.append((source, self.parse_pool.submit(
+                self.phase_index, source, self.wakeup)))
+            return
+
+        objects = self.parser.parse(source)
+        self.parsed += 1
+        metrics.parsed.inc()
+        self._store_objects(objects)
+        if self.frontier:
+            self.frontier.done(source)
+        self.in_flight.done()
+
+    def _collect_parsed(self, pending):
+        '''
+        Handles the results of the parse pool that are ready, in order.
+        Waits for the oldest one when too many are pending.
+        '''
+        while pending and (pending[0][1].ready() or
+                           len(pending) > 2 * self.phase.n_parsers):
+            source, result = pending.popleft()
+            self._handle_parsed(*result.get())
+            if self.frontier:
+                self.frontier.done(source)
+            self.in_flight.done()
+
+    def _handle_parsed(self, objects, new_sources, added, reset, parse_times,
+                       parse_time):
+        '''
+        Handles the result of a source that was parsed by the parse pool.
+        '''
+        self.parser.total_time += parse_time
+        for name, seconds in parse_times:
+            self.template_parsed(name, seconds)
+        if reset:
+            self.reset_source_queue()
+        for source in added:
+            self._add_source(source)
+
+        self.parsed += 1
+        metrics.parsed.inc()
+        self.new_sources = new_sources
+        self._store_objects(objects)
+
+    def _store_objects(self, objects):
+        for obj in objects:
+            if obj.db and obj.objects:
+                self.writers[self.dbs[obj.name]].add(obj)
+
+        for new_source in self.new_sources:
+            self._gen_source(*new_source)
+
+        self.new_sources = []
 
     def _gen_source(self, objct, attr):
+        from ..components import Attr
+
         for value in attr.value:
             # for now only "or" is supported.
             if not self._evaluate_condition(objct, attr):
@@ -174,14 +272,14 @@ class ScrapeWorker(Process):
 
             if attr.source.copy_attrs:
                 attrs_to_copy = attr.source.copy_attrs
-                assert all(attr in objct.attrs for attr in attrs_to_copy)
+                assert all(name in objct for name in attrs_to_copy)
                 if type(attrs_to_copy) == dict:
                     # We store the copied attributes under different names.
-                    for key, value in attrs_to_copy.items():
-                        attrs.append(objct.attrs[key](name=value))
+                    for key, name in attrs_to_copy.items():
+                        attrs.append(Attr(name=name, value=objct[key]))
                 else:
                     for key in attrs_to_copy:
-                        attrs.append(objct.attrs[key]())
+                        attrs.append(Attr(name=key, value=objct[key]))
 
             new_source = attr.source(url=url, attrs=attrs)
 
@@ -192,69 +290,550 @@ class ScrapeWorker(Process):
                 self._add_source(new_source)
 
     def _add_source(self, source):
-        if source.url and (source.url not in self.seen or source.duplicate) \
-                and source.url not in self.forwarded:
+        if not source.url:
+            return
+        if self.canonical:
+            source.url = self.canonical(source.url)
+        key = self._url_key(source.url)
+        if (key not in self.seen or source.duplicate) \
+                and key not in self.forwarded:
             if source.active:
-                self.to_parse += 1
-                self.source_q.put(source)
-                self.seen.add(source.url)
+                self._enqueue(source)
+                self.seen.add(key)
             else:
                 self.to_forward.append(source)
-                self.forwarded.add(source.url)
+                self.forwarded.add(key)
+                if self.frontier:
+                    self.frontier.add(source, self.phase_index, True)
+
+    def _url_key(self, url):
+        '''
+        The url under which a source is stored in the seen filters.
+        '''
+        if self.canonical:
+            return self.canonical.key(url)
+        return url
+
+    def source_dropped(self, source):
+        '''
+        Called by the source workers for a source that will not reach the
+        parser.
+        '''
+        metrics.dropped.inc()
+        if self.frontier:
+            self.frontier.done(source)
+        if self.in_flight.done():
+            # Wake up the parse loop, the phase might be done.
+            self.parse_q.put(None)
+
+    def template_parsed(self, name, seconds):
+        '''
+        Called by the parser with the time it took to parse a template.
+        '''
+        metrics.parse_seconds.observe(seconds, (name,))
 
     def value_is_new(self, objct, uri, name):
-        db_objct = self.db.read(uri, objct)
-        if db_objct and db_objct.attrs.get(name):
-            if db_objct.attrs[name].value != objct.attrs[name].value:
-                return True
-            return False
+        '''
+        Checks if the value of the attribute differs from the one stored
+        for the object with the url, an object that was not stored is new.
+        '''
+        template = self.templates.get(objct.name)
+        if objct.name not in self.dbs or not template:
+            return True
+        row = next(iter(self.dbs[objct.name].read(
+            template=template, url=uri, fields=[name])), None)
+        if row and row.get(name):
+            # Stored values can come back as lists instead of tuples.
+            return tuple(str_as_tuple(row[name])) != tuple(objct[name])
+        return True
 
     def _apply_src_template(self, source, url):
-        if source.src_template:
-            # use formatting notation in the src_template
-            return source.src_template.format(url)
-        return url
+        return apply_src_template(source, url)
 
     def _evaluate_condition(self, objct, attr, **kwargs):
         # TODO add "in", and other possibilities.
         if attr.source_condition:
             for name, cond in attr.source_condition.items():
-                values = objct.attrs[name].value
+                values = objct[name]
                 # Wrap the value in a list without for example seperating the
                 # characters.
-                values = [values] if type(values) != list else values
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
                 for val in values:
-                    if val and not eval(str(val) + cond, {}, {}):
+                    if val and not _condition_holds(val, cond):
                         return False
         return True
 
     def reset_source_queue(self):
+        '''
+        Drops the queued sources and stops taking the sources of the phase,
+        for a required template that found nothing.
+        '''
+        self.phase_sources = iter(())
+        self.sources_exhausted = True
+        cleared = []
         while not self.source_q.empty():
             try:
-                self.source_q.get(False)
+                cleared.append(self.source_q.get(False))
             except Empty:
                 continue
             self.source_q.task_done()
+        cleared.extend(self.scheduler.clear())
+        if self.frontier:
+            for source in cleared:
+                self.frontier.done(source)
+        if cleared:
+            self.in_flight.done(len(cleared))
 
-    def show_progress(self):
-        if not self.dummy:
-            os.system('clear')
-        info = '''
-        Domain              {}
-        Sources to get:     {}
-        Sources to parse:   {}
-        Sources parsed:     {}
-        Average get time:   {}s
-        Average parse time: {}s
-        '''
-        get_average = sum(w.mean for w in self.workers) / len(self.workers)
-        print(info.format(self.name,
-                          self.source_q.qsize(),
-                          self.to_parse,
-                          self.parsed,
-                          round(get_average, 3),
-                          round(self.parser.total_time / self.parsed, 3)
-                          ))
+
+class ScrapeWorker(PhaseRunner, Process):
+    def __init__(self, model, dummy=False):
+        super(ScrapeWorker, self).__init__()
+
+        self.model = model
+        # Checked before any store worker is started.
+        if model.pipeline:
+            if model.checkpoint or model.resume:
+                raise Exception('Pipelined phases can not be checkpointed')
+            if any(phase.repeat for phase in model.phases):
+                raise Exception('Phases that repeat can not be pipelined')
+        self.dead_letters = DeadLetters(model.name + '_dead_letters')
+        self._init_runner(self.dead_letters)
+        self.cache = None
+        if model.cache:
+            options = dict(model.cache) if type(model.cache) == dict else {}
+            path = options.pop('path', os.path.join('.cache', model.name))
+            self.cache = ResponseCache(path, **options)
+        self.canonical = canonicalizer(model.canonicalize)
+        self.seen = ScalableBloomFilter()
+        self.forwarded = ScalableBloomFilter()
+        self.pool = None
+        self.done_parsing = False
+        self.no_more_sources = False
+        self.dbs = dict()
+        self.templates = dict()
+        self.writers = dict()
+        self.schedule = model.schedule
+        self.dummy = dummy
+        self.archive = None
+        self.recorder = None
+        self.stages = []
+        self.reporter = None
+        self.resumed = []
+        self.next_forward = []
+
+        db_threads = defaultdict(list)
+
+        # Check if the functions in each template are used properly
+        # and store which types of databases are needed.
+        for phase in self.model.phases:
+            for template in phase.templates:
+                self.templates[template.name] = template
+                self.check_functions(template, phase)
+                if template.db_type:
+                    db_threads[template.db_type].append(template)
+
+        # Start all the threads necessary for storing the data and give each
+        # template a reference to the thread it needs to store data in.
+        for thread, templates in db_threads.items():
+            if not dummy:
+                store_thread = databases._threads[thread]()
+            else:
+                store_thread = databases._threads['dummy']()
+
+            for template in templates:
+                self.dbs[template.name] = store_thread
+            store_thread.metrics = model.metrics
+            store_thread.metrics_name = '{}_{}'.format(model.name, thread)
+            store_thread.metrics_labels = {'model': model.name}
+            store_thread.start()
+            self.writers[store_thread] = RecordWriter(store_thread.store_q)
+
+    def run(self):
+        self._create_parse_pool()
+        # Open the recording in this process so the memory maps are not
+        # shared with the parent.
+        if self.model.replay:
+            self.archive = open_archive(self.model.replay)
+        if self.model.record:
+            self.recorder = WarcWriter(self.model.record, self.model.name)
+            self.recorder.start()
+
+        if self.model.persist_seen:
+            self.seen = load_filter(self.model.name + '_seen_urls')
+            self.forwarded = load_filter(self.model.name + '_forwarded_urls')
+
+        i = 0
+        if not self.model.pipeline and \
+                (self.model.checkpoint or self.model.resume):
+            self.frontier = Frontier(self.model.name + '.frontier')
+            if self.model.resume:
+                i = self._resume()
+            else:
+                self.frontier.clear()
+
+        rate = self.model.progress
+        if rate is None:
+            rate = 2 if sys.stdout.isatty() else 0
+        if rate:
+            self.reporter = ProgressReporter(self, rate=rate)
+            self.reporter.start()
+        exporter = metrics.exporter(self.model.metrics, self.model.name)
+        if exporter:
+            self._register_gauges()
+            exporter.start()
+        try:
+            if self.model.pipeline:
+                self.run_pipeline()
+            else:
+                self.run_phases(i)
+        except KeyboardInterrupt:
+            # Stop the source workers before the queues are saved.
+            for runner in self.stages or [self]:
+                runner.stop_workers()
+            if self.frontier:
+                self._checkpoint(filters=True)
+                print('Stopped, continue with --resume')
+            self.flush_stores(stop=True)
+            raise
+        finally:
+            # The source workers would keep the process alive, and the
+            # event loops of the async ones would outlive the interpreter.
+            for runner in self.stages or [self]:
+                runner.stop_workers()
+            if self.reporter:
+                self.reporter.stop()
+            if exporter:
+                exporter.stop()
+
+        # Only a finished crawl is remembered, the seen filter also holds
+        # the urls that were queued but not parsed.
+        if self.model.persist_seen:
+            save_filter(self.seen, self.model.name + '_seen_urls')
+            save_filter(self.forwarded, self.model.name + '_forwarded_urls')
+
+        if self.pool:
+            self.pool.close()
+        if self.recorder:
+            self.recorder.stop()
+        self.flush_stores(stop=True)
+        print('Waiting for the database')
+        print('Scraper fully stopped')
+
+    def run_phases(self, i):
+        # create the threads needed to scrape
+        while i < len(self.model.phases):
+            # if self.is_scheduled():
+            phase = self.model.phases[i]
+            self.phase = phase
+            self.phase_index = i
+            print('running phase:', i, phase.name)
+
+            # Check if the phase has a parser, if not, reuse the one from the
+            # last phase.
+            self.parsed = 0
+
+            if phase.active:
+                self.spawn_workforce(phase)
+                self.add_sources(phase)
+                self.to_forward, self.next_forward = self.next_forward, []
+                for source in self.resumed:
+                    self.in_flight.add()
+                    self.source_q.put(source)
+                self.resumed = []
+                self.parse_sources()
+                # A later phase can read the objects from the database.
+                self.flush_stores()
+
+            if not phase.repeat:
+                i += 1
+            self.taken = 0
+            if self.frontier:
+                self.frontier.end_phase(self.phase_index, phase.active,
+                                        self._filters(),
+                                        **self._frontier_state(i))
+
+    def run_pipeline(self):
+        '''
+        Runs the active phases at the same time, each in a PhaseStage with
+        its own workers and parser. The sources a phase forwards go to the
+        next stage right away, the sources of a phase itself are taken once
+        the stages before it are done.
+        '''
+        self.parsed = 0
+        # The stages set the event when they have something to do.
+        self.wakeup = Event()
+        stages = []
+        parser = None
+        for i, phase in enumerate(self.model.phases):
+            if phase.active:
+                print('running phase:', i, phase.name)
+                stages.append(PhaseStage(self, phase, i, parser))
+                parser = stages[-1].parser
+        self.parser = parser
+        # The finished stages stay in the progress report.
+        self.stages = list(stages)
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+        if stages:
+            stages[0].take_sources()
+
+        while stages:
+            busy = False
+            for stage in stages:
+                busy = stage.step() or busy
+            for writer in self.writers.values():
+                if writer.due():
+                    writer.flush()
+
+            # A stage can only finish after the stages before it.
+            while stages and stages[0].finished():
+                stage = stages.pop(0)
+                stage.stop()
+                busy = True
+                self.flush_stores()
+                self.parsed += stage.parsed
+                print('finished phase:', stage.phase_index, stage.phase.name)
+                if stages:
+                    stages[0].take_sources()
+            if not busy:
+                # The timeout keeps the writers going.
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+
+    def _create_parse_pool(self):
+        '''
+        Creates the pool for the phases with more than one parser, before
+        any thread is started.
+        '''
+        phases = {}
+        parser_class = None
+        for i, phase in enumerate(self.model.phases):
+            parser_class = phase.parser or parser_class
+            if phase.active and phase.n_parsers > 1 and parser_class:
+                phases[i] = (parser_class, phase.templates)
+        if phases:
+            n_parsers = max(self.model.phases[i].n_parsers for i in phases)
+            self.pool = ParsePool(n_parsers, phases, self.name, self.model)
+
+    def _register_gauges(self):
+        metrics.registry.labels = {'model': self.model.name}
+        metrics.registry.gauge('modelscraper_queue_depth',
+                               'Sources or messages waiting in a queue',
+                               self._queue_depths, ('queue',))
+        metrics.registry.gauge(
+            'modelscraper_in_flight',
+            'Sources that are queued and not parsed or dropped yet',
+            lambda: sum(runner.in_flight.count
+                        for runner in self.stages or [self]))
+
+    def _queue_depths(self):
+        runners = self.stages or [self]
+        depths = {('source_q',): sum(runner.scheduler.qsize()
+                                     for runner in runners),
+                  ('parse_q',): sum(runner.parse_q.qsize()
+                                    for runner in runners)}
+        try:
+            depths[('store_q',)] = sum(db.store_q.qsize()
+                                       for db in set(self.dbs.values()))
+        except NotImplementedError:
+            # Multiprocessing queues have no size on macOS.
+            pass
+        return depths
+
+    def _frontier_state(self, phase_index):
+        return {'phase': phase_index, 'taken': self.taken}
+
+    def _filters(self):
+        return {'seen': self.seen, 'forwarded': self.forwarded}
+
+    def _checkpoint(self, filters=False):
+        # The parsed sources are only finished once their objects are stored.
+        self.flush_stores(finish=False)
+        filters = filters or self.frontier.filters_due()
+        self.frontier.checkpoint(self._filters() if filters else None,
+                                 **self._frontier_state(self.phase_index))
+
+    def flush_stores(self, stop=False, finish=True):
+        '''
+        Sends the buffered objects to the store workers and waits until they
+        have written everything they received. With stop the store workers
+        stop afterwards, without finish they leave their files open.
+        '''
+        message = None if stop else FLUSH if finish else SYNC
+        # The templates of one database type share a store worker.
+        store_workers = set(self.dbs.values())
+        for db in store_workers:
+            self.writers[db].flush()
+            db.store_q.put(message)
+        for db in store_workers:
+            db.store_q.join()
+
+    def _resume(self):
+        '''
+        Restores the state of the last checkpoint and returns the index of
+        the phase to continue with.
+        '''
+        i = self.frontier.state('phase', 0)
+        self.taken = self.frontier.state('taken', 0)
+        self.seen = self.frontier.state('seen', self.seen)
+        self.forwarded = self.frontier.state('forwarded', self.forwarded)
+        self.to_forward = self.frontier.forwarded(i, before=True)
+        self.next_forward = list(self.frontier.forwarded(i))
+        self.resumed = self.frontier.pending(i)
+        # The filters can be older than the last checkpoint of the sources.
+        for source in self.resumed:
+            self.seen.add(self._url_key(source.url))
+        for source in self.next_forward:
+            self.forwarded.add(self._url_key(source.url))
+        if i < len(self.model.phases):
+            print('resuming phase', i, 'with', len(self.resumed),
+                  'sources to parse, skipping', self.taken, 'sources')
+        else:
+            print('Nothing to resume, the crawl has finished')
+        return i
+
+    def parse_sources(self):
+        # Sources that are being parsed by the parse pool, in order.
+        pending = deque()
+        while True:
+            self._collect_parsed(pending)
+            if self.frontier and self.frontier.due():
+                self._checkpoint()
+            for writer in self.writers.values():
+                if writer.due():
+                    writer.flush()
+            self._fill_frontier()
+            if self.in_flight.idle() and self.sources_exhausted:
+                break
+            # The timeout only keeps the checkpoints and the writers going,
+            # source_dropped wakes the loop up when the last source is gone.
+            try:
+                source = self.parse_q.get(timeout=0.1 if pending else 1)
+            except Empty:
+                source = None
+
+            if source is not None:
+                self._parse(source, pending)
+
+        print('Unparsed ', self.scheduler.qsize())
+
+    def add_sources(self, phase):
+        '''
+        Starts taking the sources of the phase and the forwarded sources.
+        The sources are taken lazily, so generators and database cursors
+        are never held in memory as a whole.
+        '''
+        self.frontier_size = phase.frontier_size
+        self.phase_sources = self._iter_sources(phase, self.to_forward,
+                                                skip=self.taken)
+        self.sources_exhausted = False
+        self._fill_frontier()
+
+    def _iter_sources(self, phase, forwarded, skip=0):
+        '''
+        Yields the forwarded sources and then the sources of the phase,
+        without the first `skip` ones that were taken before a resume. With
+        Phase.synchronize the forwarded sources that are stored already are
+        yielded as None, so they still count as taken: True reads the stored
+        urls into a set, 'bloom' into a Bloom filter and 'query' asks the
+        database per batch of sources.
+        '''
+        forwarded = iter(forwarded)
+        skip -= sum(1 for _ in islice(forwarded, skip))
+        if phase.synchronize == 'query':
+            yield from self._unscraped_sources(phase, forwarded)
+        elif phase.synchronize:
+            urls_in_db = self._stored_urls(phase)
+            for source in forwarded:
+                yield source if source.url not in urls_in_db else None
+        else:
+            yield from forwarded
+        yield from islice(self._phase_sources(phase), skip, None)
+
+    def _phase_sources(self, phase):
+        for source in phase.sources:
+            if source.from_db:
+                yield from self._sources_from_db(source)
+            elif source.active:
+                yield source
+
+    def _stored_urls(self, phase):
+        urls_in_db = set()
+        if phase.synchronize == 'bloom':
+            urls_in_db = ScalableBloomFilter(
+                mode=ScalableBloomFilter.LARGE_SET_GROWTH)
+        for url in self.get_scraped_urls(phase):
+            urls_in_db.add(url)
+        return urls_in_db
+
+    def _sources_from_db(self, source):
+        '''
+        Creates a copy of the source for every object in the template in
+        source.from_db, with the url of the object.
+        '''
+        from ..components import Attr
+
+        template = source.from_db
+        db = self.dbs.get(template.name) or \
+            databases._threads[template.db_type]()
+        fields = ['url', *(source.copy_attrs or ())]
+        for row in db.read(template=template, fields=fields):
+            url = first(row.get('url'))
+            if not url:
+                continue
+            attrs = [Attr(name=name, value=row[name])
+                     for name in source.copy_attrs or () if name in row]
+            yield source(url=url, attrs=attrs, from_db=None)
+
+    def _unscraped_sources(self, phase, forwarded, batch_size=1000):
+        '''
+        Asks the databases of the phase which of the forwarded sources
+        were scraped already, per batch of sources. Those are yielded as
+        None.
+        '''
+        templates = [template for template in phase.templates
+                     if template.name in self.dbs]
+        forwarded = iter(forwarded)
+        while True:
+            batch = list(islice(forwarded, batch_size))
+            if not batch:
+                return
+            urls = {source.url for source in batch}
+            stored = set()
+            for template in templates:
+                stored |= self.dbs[template.name].urls_stored(template,
+                                                              urls)
+            for source in batch:
+                yield source if source.url not in stored else None
+
+    def get_scraped_urls(self, phase):
+        for template in phase.templates:
+            if template.name in self.dbs:
+                yield from self.dbs[template.name].read_urls(template)
+
+    def progress(self):
+        '''
+        The numbers the ProgressReporter shows, per phase that is running,
+        or per stage when the phases are pipelined.
+        '''
+        phases = []
+        for runner in self.stages or [self]:
+            if runner.phase is None or runner.parser is None:
+                continue
+            workers = runner.workers
+            get_time = sum(w.mean for w in workers) / len(workers) \
+                if workers else 0
+            parse_time = runner.parser.total_time / runner.parsed \
+                if runner.parsed else 0
+            phases.append({'phase': runner.phase_index,
+                           'name': runner.phase.name,
+                           'queued': runner.scheduler.qsize(),
+                           'in_flight': runner.in_flight.count,
+                           'parsed': runner.parsed,
+                           'get_time': round(get_time, 3),
+                           'parse_time': round(parse_time, 4)})
+        return phases
 
     def check_functions(self, template, phase):
         error_string = "One of these functions: {} is not implemented in {}."
@@ -268,3 +847,111 @@ class ScrapeWorker(Process):
         if not_implemented:
             raise Exception(error_string.format(str(not_implemented),
                                                 phase.parser.__class__.__name__))
+
+
+class PhaseStage(PhaseRunner):
+    '''
+    Takes the place of the ScrapeWorker for one phase when the phases are
+    pipelined. A stage has its own queues, scheduler, source workers and
+    parser, the model, databases and seen urls are shared with the
+    ScrapeWorker. The schedulers of the stages share the state per host,
+    so the delay and the concurrency of a host hold for all the stages
+    together. The sources the phase forwards are passed to the next stage
+    as soon as they are found.
+    '''
+    def __init__(self, worker, phase, phase_index, parser=None):
+        self.worker = worker
+        self.model = worker.model
+        self.name = worker.name
+        self.dummy = worker.dummy
+        self.cache = worker.cache
+        self.recorder = worker.recorder
+        self.archive = worker.archive
+        self.canonical = worker.canonical
+        self.seen = worker.seen
+        self.forwarded = worker.forwarded
+        self.dbs = worker.dbs
+        self.templates = worker.templates
+        self.writers = worker.writers
+        self.pool = worker.pool
+        self._init_runner(worker.dead_letters, worker.scheduler.hosts,
+                          worker.wakeup)
+
+        self.phase = phase
+        self.phase_index = phase_index
+        self.frontier_size = phase.frontier_size
+        self.parser = parser
+        self.next_stage = None
+        self.inbox = deque()
+        self.pending = deque()
+        self.urls_in_db = None
+        self.started = False
+        self.spawn_workforce(phase)
+
+    def receive(self, sources):
+        '''
+        Takes the sources forwarded by the previous stage, with
+        Phase.synchronize the ones that are stored already are skipped.
+        '''
+        if self.phase.synchronize == 'query':
+            sources = (source for source in
+                       self.worker._unscraped_sources(self.phase, sources)
+                       if source is not None)
+        elif self.phase.synchronize:
+            if self.urls_in_db is None:
+                self.urls_in_db = self.worker._stored_urls(self.phase)
+            sources = (source for source in sources
+                       if source.url not in self.urls_in_db)
+        self.inbox.extend(sources)
+
+    def take_sources(self):
+        '''
+        Starts taking the sources of the phase itself, once the stages
+        before it are done.
+        '''
+        self.phase_sources = self.worker._phase_sources(self.phase)
+        self.sources_exhausted = False
+        self.started = True
+
+    def reset_source_queue(self):
+        # The forwarded sources that were not queued yet are dropped too.
+        self.inbox.clear()
+        super().reset_source_queue()
+
+    def _fill_frontier(self):
+        while self.inbox and self.scheduler.qsize() < self.frontier_size:
+            self._enqueue(self.inbox.popleft())
+        super()._fill_frontier()
+
+    def step(self):
+        '''
+        Handles the parsed sources and parses the downloaded ones without
+        waiting for more. Returns whether there was anything to do.
+        '''
+        n_pending = len(self.pending)
+        self._collect_parsed(self.pending)
+        busy = len(self.pending) < n_pending
+        self._fill_frontier()
+        for _ in range(self.frontier_size):
+            try:
+                source = self.parse_q.get(False)
+            except Empty:
+                break
+            busy = True
+            if source is not None:
+                self._parse(source, self.pending)
+
+        if self.to_forward:
+            if self.next_stage:
+                self.next_stage.receive(self.to_forward)
+            self.to_forward = []
+        return busy
+
+    def finished(self):
+        if not self.started or not self.sources_exhausted or self.inbox or \
+                self.pending or not self.parse_q.empty():
+            return False
+        return self.in_flight.idle()
+
+    def stop(self):
+        self.source_kill.set()
@@ -19,7 +19,17 @@ available_models = [f[:-3] for f in os.listdir('scrape_models')
 @click.command()
 @click.argument('model', nargs=-1)
 @click.option('--dummy', default=False, help='Whether to do a dummy run')
-def main(model, dummy):
+@click.option('--record', default=None,
+              help='Directory to record the responses in as WARC files')
+@click.option('--checkpoint', is_flag=True,
+              help='Keep the state of the crawl on disk so it can be resumed')
+@click.option('--resume', is_flag=True,
+              help='Continue the crawl from the last checkpoint')
+@click.option('--pipeline', is_flag=True,
+              help='Run the phases at the same time instead of one by one')
+@click.option('--metrics', default=None,
+              help='Directory to write the metrics to as OpenMetrics files')
+def main(model, dummy, record, checkpoint, resume, pipeline, metrics):
     if len(model) == 1:
         model = model[0]
     dispatcher = Dispatcher()
@@ -31,6 +41,14 @@ def main(model, dummy):
     imported = vars(importlib.import_module(f'scrape_models.{model}')).values()
     scrape_models = [model for model in imported
                      if type(model) == ScrapeModel]
+    if record:
+        for scrape_model in scrape_models:
+            scrape_model.record = record
+    for scrape_model in scrape_models:
+        scrape_model.checkpoint = scrape_model.checkpoint or checkpoint
+        scrape_model.resume = resume
+        scrape_model.pipeline = scrape_model.pipeline or pipeline
+        scrape_model.metrics = scrape_model.metrics or metrics
     dispatcher.add_scraper(scrape_models, dummy=dummy)
     dispatcher.run()
 
@@ -0,0 +1,125 @@
+from datetime import timedelta
+from types import SimpleNamespace
+import signal
+
+import pytest
+
+from modelscraper.components import ScrapeModel
+from modelscraper.records import Batch, Record, RecordWriter, Schema
+from modelscraper.workers.scrape_worker import ScrapeWorker
+
+
+class Source:
+    '''
+    The fields of a components.Source that the scheduling and the frontier
+    use, without the converters of the attrs class.
+    '''
+    def __init__(self, url, host_delay=None, host_concurrency=None,
+                 retries=10):
+        self.url = url
+        self.host_delay = host_delay
+        self.host_concurrency = host_concurrency
+        self.retries = retries
+        self.attempts = 0
+        self.method = 'get'
+        self.params = {}
+        self.data = {}
+        self.headers = {}
+        self.frontier_id = None
+
+
+@pytest.fixture
+def make_source():
+    return Source
+
+
+class Response:
+    '''
+    The fields of a requests.Response that the source workers use.
+    '''
+    def __init__(self, content=b'', status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.reason = 'OK' if status_code == 200 else ''
+        self.headers = headers or {}
+        self.elapsed = timedelta(seconds=0.1)
+        self.request = None
+
+
+class Session:
+    '''
+    A requests.Session that answers with the given responses in order and
+    keeps the requests it received.
+    '''
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, data=None, params=None, headers=None):
+        response = self.responses.pop(0)
+        response.request = SimpleNamespace(url=url, headers=headers or {},
+                                           body=None)
+        self.requests.append(response.request)
+        return response
+
+
+@pytest.fixture
+def make_session():
+    def make(*responses):
+        return Session(*(Response(**response) for response in responses))
+
+    return make
+
+
+@pytest.fixture
+def make_worker(tmpdir, monkeypatch):
+    '''
+    Creates ScrapeWorkers for a model with the given phases, in a temporary
+    directory. The source workers they started are stopped afterwards.
+    '''
+    monkeypatch.chdir(tmpdir)
+    workers = []
+
+    def make(*phases, **kwargs):
+        worker = ScrapeWorker(ScrapeModel(name='test', phases=list(phases),
+                                          **kwargs))
+        workers.append(worker)
+        return worker
+
+    yield make
+    for worker in workers:
+        worker.stop_workers()
+
+
+@pytest.fixture
+def make_batch():
+    '''
+    Creates the Batch of records a store worker hands to its adapter.
+    '''
+    def make(table, columns, *rows, db='db', func='create', kws=None):
+        schema = Schema(None, table, db, table, func, kws or {}, columns)
+        return Batch(schema, [Record(schema, tuple(row)) for row in rows])
+
+    return make
+
+
+@pytest.fixture
+def run_store():
+    '''
+    Sends the batches to a store worker and runs it in this process until
+    it has stored them and stopped.
+    '''
+    def run(store, *batches):
+        writer = RecordWriter(store.store_q)
+        for batch in batches:
+            writer.add(batch)
+        writer.flush()
+        store.store_q.put(None)
+        # The worker ignores Ctrl-C, which would hold for all the tests.
+        handler = signal.getsignal(signal.SIGINT)
+        try:
+            store.run()
+        finally:
+            signal.signal(signal.SIGINT, handler)
+
+    return run
@@ -0,0 +1,83 @@
+from threading import Event
+import time
+
+from modelscraper.cache import ResponseCache, fingerprint
+from modelscraper.components import Phase, Source
+from modelscraper.sources import WebSource
+
+
+def test_fingerprint():
+    assert fingerprint('get', 'http://a.nl/?a=1&b=2') == \
+        fingerprint('GET', 'http://a.nl/', {'b': 2, 'a': 1})
+    assert fingerprint('post', 'http://a.nl/', data={'b': 2, 'a': 1}) == \
+        fingerprint('post', 'http://a.nl/', data=b'a=1&b=2')
+    assert fingerprint('post', 'http://a.nl/', data={'a': 1}) != \
+        fingerprint('get', 'http://a.nl/', data={'a': 1})
+
+
+def test_freshness(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put('aa1', 'http://a.nl/1', {'Cache-Control': 'max-age=60'}, b'1')
+    cache.put('aa2', 'http://a.nl/2', {'Cache-Control': 'no-cache',
+                                       'ETag': '"2"'}, b'2')
+    cache.put('aa3', 'http://a.nl/3', {'Cache-Control': 'no-store'}, b'3')
+    assert cache.get('aa1').fresh
+    assert cache.get('aa1').body == b'1'
+    assert not cache.get('aa2').fresh
+    assert cache.get('aa3') is None
+
+
+def test_refresh_after_not_modified(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.put('aa1', 'http://a.nl/1', {
+        'ETag': '"1"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'},
+        b'1')
+    entry = cache.get('aa1')
+    assert not entry.fresh
+    assert entry.validators() == {
+        'If-None-Match': '"1"',
+        'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT'}
+    cache.refresh('aa1', {'Cache-Control': 'max-age=60'})
+    # The refreshed entry is stored, a new cache finds it fresh.
+    entry = ResponseCache(str(tmpdir)).get('aa1')
+    assert entry.fresh
+    assert entry.body == b'1'
+
+
+def test_ttl(tmpdir):
+    cache = ResponseCache(str(tmpdir), ttl=60)
+    cache.put('aa1', 'http://a.nl/1', {}, b'1')
+    assert cache.get('aa1').meta['expires'] > time.time() + 50
+
+
+def test_least_recently_used_are_evicted(tmpdir):
+    cache = ResponseCache(str(tmpdir), max_size=8)
+    cache.put('aa1', 'http://a.nl/1', {}, b'1111')
+    cache.put('aa2', 'http://a.nl/2', {}, b'2222')
+    cache.get('aa1')
+    cache.put('aa3', 'http://a.nl/3', {}, b'3333')
+    assert list(cache) == ['aa1', 'aa3']
+    assert cache.size == 8
+    assert sorted(ResponseCache(str(tmpdir))) == ['aa1', 'aa3']
+
+
+def source_worker(make_worker, session):
+    worker = make_worker(Phase(sources=[], templates=[]), session=session,
+                         cache={'path': 'cache'})
+    return WebSource(parent=worker, stop_event=Event())
+
+
+def test_web_source_revalidates(make_worker, make_session):
+    session = make_session(
+        {'content': b'page', 'headers': {'ETag': '"1"'}},
+        {'status_code': 304, 'headers': {'Cache-Control': 'max-age=60'}})
+    web = source_worker(make_worker, session)
+    assert web.retrieve(Source(url='http://a.nl/')).data == b'page'
+    assert web.requested
+    # The stale response is revalidated and its body used after a 304.
+    assert web.retrieve(Source(url='http://a.nl/')).data == b'page'
+    assert session.requests[1].headers['If-None-Match'] == '"1"'
+    # A fresh response is served without a request.
+    assert web.retrieve(Source(url='http://a.nl/')).data == b'page'
+    assert not web.requested
+    assert len(session.requests) == 2
@@ -0,0 +1,83 @@
+from modelscraper.frontier import Frontier
+
+
+def urls(sources):
+    return [source.url for source in sources]
+
+
+def test_pending_sources_are_resumed(tmpdir, make_source):
+    path = str(tmpdir.join('model.frontier'))
+    frontier = Frontier(path)
+    sources = [make_source('http://a.nl/{}'.format(i)) for i in range(3)]
+    for source in sources:
+        frontier.add(source, 0)
+    frontier.done(sources[0])
+    frontier.checkpoint(phase=0, taken=3)
+    frontier.done(sources[1])
+    frontier.close()
+
+    # The source parsed after the checkpoint is parsed again.
+    frontier = Frontier(path)
+    pending = frontier.pending(0)
+    assert urls(pending) == ['http://a.nl/1', 'http://a.nl/2']
+    assert [source.frontier_id for source in pending] == [2, 3]
+    assert frontier.state('phase') == 0
+    assert frontier.state('taken') == 3
+
+    frontier.done(pending[0])
+    frontier.checkpoint()
+    assert urls(frontier.pending(0)) == ['http://a.nl/2']
+    # New sources do not reuse the ids of the stored ones.
+    source = make_source('http://a.nl/3')
+    frontier.add(source, 0)
+    assert source.frontier_id == 4
+
+
+def test_done_before_checkpoint(tmpdir, make_source):
+    frontier = Frontier(str(tmpdir.join('model.frontier')))
+    source = make_source('http://a.nl/')
+    frontier.add(source, 0)
+    frontier.done(source)
+    frontier.checkpoint()
+    assert frontier.pending(0) == []
+
+
+def test_end_phase(tmpdir, make_source):
+    frontier = Frontier(str(tmpdir.join('model.frontier')))
+    frontier.add(make_source('http://a.nl/queued'), 0)
+    frontier.add(make_source('http://a.nl/forwarded'), 0, forwarded=True)
+    frontier.add(make_source('http://b.nl/forwarded'), 1, forwarded=True)
+    frontier.end_phase(0, phase=1)
+    assert frontier.pending(0) == []
+    assert urls(frontier.forwarded(1, before=True)) == [
+        'http://a.nl/forwarded']
+    assert urls(frontier.forwarded(1)) == ['http://b.nl/forwarded']
+    assert frontier.state('phase') == 1
+
+    # An inactive phase leaves the forwarded sources to the next one.
+    frontier.end_phase(1, consumed=False)
+    assert urls(frontier.forwarded(2, before=True)) == [
+        'http://a.nl/forwarded', 'http://b.nl/forwarded']
+    frontier.end_phase(2)
+    assert list(frontier.forwarded(3, before=True)) == []
+
+
+def test_filters_only_when_given(tmpdir):
+    frontier = Frontier(str(tmpdir.join('model.frontier')),
+                        filter_interval=0)
+    frontier.checkpoint(phase=0)
+    assert frontier.state('seen') is None
+    assert frontier.filters_due()
+    frontier.checkpoint({'seen': {'http://a.nl/'}}, phase=0)
+    assert frontier.state('seen') == {'http://a.nl/'}
+    frontier.filter_interval = 60
+    assert not frontier.filters_due()
+
+
+def test_clear(tmpdir, make_source):
+    frontier = Frontier(str(tmpdir.join('model.frontier')))
+    frontier.add(make_source('http://a.nl/'), 0)
+    frontier.checkpoint(phase=0)
+    frontier.clear()
+    assert frontier.pending(0) == []
+    assert frontier.state('phase', 'none') == 'none'
@@ -0,0 +1,55 @@
+import pytest
+
+from modelscraper.databases import jsonl
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+@pytest.mark.parametrize('compression', ['zstd', 'gzip'])
+def test_round_trip(make_batch, run_store, workdir, compression):
+    if compression == 'zstd' and jsonl.zstandard is None:
+        pytest.skip('zstandard is not installed')
+    store = jsonl.JSONLines(compression=compression)
+    batch = make_batch('article', ('url', 'title'),
+                       (('http://nu.nl/1',), ('One',)),
+                       (('http://nu.nl/2',), ('Two',)))
+    run_store(store, batch)
+    # The file is rotated and compressed when the worker stops.
+    [path] = workdir.join('db', 'article').listdir()
+    assert path.ext == {'zstd': '.zst', 'gzip': '.gz'}[compression]
+    assert list(store.read(batch)) == [
+        {'url': ['http://nu.nl/1'], 'title': ['One']},
+        {'url': ['http://nu.nl/2'], 'title': ['Two']}]
+    assert list(store.read(batch, url='http://nu.nl/2')) == [
+        {'url': ['http://nu.nl/2'], 'title': ['Two']}]
+    assert list(store.read_urls(batch)) == ['http://nu.nl/1',
+                                            'http://nu.nl/2']
+
+
+def test_rotate(make_batch, run_store, workdir):
+    store = jsonl.JSONLines(compression='gzip', rotate_size=1, cache=1)
+    batch = make_batch('article', ('url', 'title'), ('http://nu.nl/2', 'b'))
+    run_store(store, make_batch('article', ('url',), ('http://nu.nl/1',)),
+              batch)
+    assert len(workdir.join('db', 'article').listdir()) == 2
+    assert sorted(store.read_urls(batch)) == ['http://nu.nl/1',
+                                              'http://nu.nl/2']
+
+
+def test_files_left_behind(make_batch, run_store, workdir):
+    # A crashed worker leaves a plain file, with a partly written line.
+    directory = workdir.join('db', 'article')
+    directory.ensure(dir=True)
+    directory.join('article-old.jsonl').write(
+        '{"url": "http://nu.nl/1"}\n{"url": "htt')
+    batch = make_batch('article', ('url',), ('http://nu.nl/2',))
+    store = jsonl.JSONLines(compression='gzip')
+    assert list(store.read_urls(batch)) == ['http://nu.nl/1']
+    run_store(store, batch)
+    assert not directory.listdir(lambda path: path.ext == '.jsonl')
+    assert sorted(store.read_urls(batch)) == ['http://nu.nl/1',
+                                              'http://nu.nl/2']
@@ -0,0 +1,42 @@
+import pytest
+
+from modelscraper.databases import parquet
+
+pytestmark = pytest.mark.skipif(parquet.pyarrow is None,
+                                reason='pyarrow is not installed')
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+def test_round_trip(make_batch, run_store):
+    store = parquet.Parquet()
+    batch = make_batch('article', ('url', 'title'),
+                       ('http://nu.nl/1', ('One',)),
+                       ('http://nu.nl/2', ('Two', 'Three')))
+    run_store(store, batch)
+    assert list(store.read(batch)) == [
+        {'url': ['http://nu.nl/1'], 'title': ['One']},
+        {'url': ['http://nu.nl/2'], 'title': ['Two', 'Three']}]
+    assert list(store.read_urls(batch)) == ['http://nu.nl/1', 'http://nu.nl/2']
+    assert [row['title'] for row in store.read(batch, url='http://nu.nl/2')] \
+        == [['Two', 'Three']]
+
+
+def test_new_columns_start_a_new_file(make_batch, run_store, workdir):
+    store = parquet.Parquet(row_group_size=1, cache=1)
+    batch = make_batch('article', ('url', 'title'), ('http://nu.nl/2', 'Two'))
+    run_store(store, make_batch('article', ('url',), ('http://nu.nl/1',)),
+              batch)
+    assert len(workdir.join('db', 'article').listdir()) == 2
+    assert sorted(row['url'][0] for row in store.read(batch)) == \
+        ['http://nu.nl/1', 'http://nu.nl/2']
+
+
+def test_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr(parquet, 'pyarrow', None)
+    with pytest.raises(ImportError):
+        parquet.Parquet()
@@ -0,0 +1,71 @@
+from modelscraper.components import Attr, Phase, Source, Template
+from modelscraper.parsers import HTMLParser
+
+
+PAGE = b'''<html><body>
+<div class="car"><h2> Golf </h2><span class="price">EUR 1.500</span>
+  <a href="http://nu.nl/golf">Golf</a><a href="http://nu.nl/golf/2">2</a>
+</div>
+<div class="car"><h2>Polo</h2><span class="price">EUR 900</span></div>
+<div class="car"><p>Sold out</p></div>
+</body></html>'''
+
+
+def cars(**kwargs):
+    return Template(name='car', selector='div.car', attrs=[
+        Attr(name='name', selector='h2', func='sel_text'),
+        Attr(name='price', selector='span.price', func='sel_text',
+             kws={'numbers': True}),
+        Attr(name='links', selector='a', func='sel_url')], **kwargs)
+
+
+def parse(make_worker, template, source):
+    worker = make_worker(Phase(sources=[], templates=[template]))
+    parser = HTMLParser(parent=worker, templates=[template])
+    return worker, list(parser.parse(source))
+
+
+def test_objects(make_worker):
+    worker, [batch] = parse(make_worker, cars(),
+                            Source(url='http://nu.nl/cars', data=PAGE))
+    assert batch.name == 'car'
+    # The car without any values is left out.
+    assert [objct.to_dict() for objct in batch.objects] == [
+        {'url': ('http://nu.nl/cars',), 'name': ('Golf',),
+         'price': (1500,),
+         'links': ['http://nu.nl/golf', 'http://nu.nl/golf/2']},
+        {'url': ('http://nu.nl/cars',), 'name': ('Polo',), 'price': (900,),
+         'links': []}]
+
+
+def test_source_attrs_are_copied(make_worker):
+    source = Source(url='http://nu.nl/cars', data=PAGE,
+                    attrs=[Attr(name='brand', value='VW'),
+                           Attr(name='name', value='replaced')])
+    worker, [batch] = parse(make_worker, cars(), source)
+    assert batch.objects[0].schema.columns == \
+        ('url', 'brand', 'name', 'price', 'links')
+    assert [(objct['brand'], objct['name']) for objct in batch.objects] == \
+        [(('VW',), ('Golf',)), (('VW',), ('Polo',))]
+
+
+def test_schema_is_shared(make_worker):
+    template = cars()
+    worker = make_worker(Phase(sources=[], templates=[template]))
+    parser = HTMLParser(parent=worker, templates=[template])
+    first = list(parser.parse(Source(url='http://nu.nl/1', data=PAGE)))
+    second = list(parser.parse(Source(url='http://nu.nl/2', data=PAGE)))
+    assert first[0].objects[0].schema is second[0].objects[1].schema
+
+
+def test_attrs_with_a_source_create_sources(make_worker):
+    template = Template(name='car', selector='div.car', attrs=[
+        Attr(name='name', selector='h2', func='sel_text'),
+        Attr(name='links', selector='a', func='sel_url', source=Source())])
+    worker, [batch] = parse(make_worker, template,
+                            Source(url='http://nu.nl/cars', data=PAGE))
+    [(objct, attr)] = worker.new_sources
+    assert objct is batch.objects[0]
+    assert attr.value == ['http://nu.nl/golf', 'http://nu.nl/golf/2']
+    # The prototype is copied, the template attr keeps its definition.
+    assert template.attrs['links'].value is None
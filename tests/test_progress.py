@@ -0,0 +1,58 @@
+import io
+import json
+
+import pytest
+
+from modelscraper.components import Phase
+from modelscraper.parsers import HTMLParser
+from modelscraper.progress import ProgressReporter
+
+
+@pytest.fixture
+def worker(make_worker):
+    phase = Phase(name='articles', sources=[], templates=[])
+    worker = make_worker(phase)
+    worker.phase = phase
+    worker.parser = HTMLParser(parent=worker, templates=[])
+    return worker
+
+
+def test_json_lines_when_not_a_terminal(worker):
+    stream = io.StringIO()
+    reporter = ProgressReporter(worker, stream=stream)
+    assert reporter.machine
+    reporter.sampled -= 2
+    worker.parsed = 10
+    worker.parser.total_time = 1
+    reporter.report()
+    worker.parsed = 12
+    reporter.report()
+    first, second = map(json.loads, stream.getvalue().splitlines())
+    assert first['model'] == 'test'
+    [phase] = first['phases']
+    assert phase['name'] == 'articles'
+    assert phase['parsed'] == 10
+    assert phase['rate'] == pytest.approx(5, rel=0.1)
+    assert phase['parse_time'] == 0.1
+    assert second['phases'][0]['parsed'] == 12
+
+
+def test_redrawn_on_a_terminal(worker):
+    stream = io.StringIO()
+    reporter = ProgressReporter(worker, stream=stream, machine=False)
+    reporter.report()
+    assert '\x1b' not in stream.getvalue()
+    assert 'phase 0 articles' in stream.getvalue()
+    reporter.report()
+    # The second report replaces the two lines of the first one.
+    assert stream.getvalue().count('\x1b[2F\x1b[J') == 1
+
+
+def test_reports_until_stopped(worker):
+    stream = io.StringIO()
+    reporter = ProgressReporter(worker, rate=100, stream=stream)
+    reporter.start()
+    reporter.stop()
+    assert not reporter.is_alive()
+    # The final report is written after the thread stopped.
+    assert len(stream.getvalue().splitlines()) >= 1
@@ -0,0 +1,106 @@
+from queue import Queue
+import datetime
+
+import pytest
+
+from modelscraper import records
+from modelscraper.records import RecordReader, RecordWriter, decode, encode
+
+
+def read(queue):
+    reader = RecordReader()
+    batches = []
+    while not queue.empty():
+        for schema, objects in reader.read(queue.get()):
+            batches.append((schema.name, [objct.to_dict()
+                                          for objct in objects]))
+    return batches
+
+
+def test_records_round_trip(make_batch):
+    queue = Queue()
+    writer = RecordWriter(queue)
+    writer.add(make_batch('article', ('url', 'title'),
+                          ('http://nu.nl/1', ('One',)),
+                          ('http://nu.nl/2', ('Two',))))
+    writer.add(make_batch('author', ('url', 'name'), ('http://nu.nl/a', 'A')))
+    writer.flush()
+    assert queue.qsize() == 1
+    assert read(queue) == [
+        ('article', [{'url': 'http://nu.nl/1', 'title': ('One',)},
+                     {'url': 'http://nu.nl/2', 'title': ('Two',)}]),
+        ('author', [{'url': 'http://nu.nl/a', 'name': 'A'}])]
+
+
+def test_schema_sent_once(make_batch):
+    queue = Queue()
+    writer = RecordWriter(queue)
+    reader = RecordReader()
+    writer.add(make_batch('article', ('url', 'title'),
+                          ('http://nu.nl/1', 'a')))
+    writer.flush()
+    first = queue.get()
+    assert len(decode(first)[0]) == 1
+    list(reader.read(first))
+    writer.add(make_batch('article', ('url', 'title'),
+                          ('http://nu.nl/2', 'b')))
+    writer.flush()
+    second = queue.get()
+    assert len(decode(second)[0]) == 0
+    [(schema, objects)] = reader.read(second)
+    assert objects[0]['title'] == 'b'
+    assert objects[0].url == 'http://nu.nl/2'
+
+
+def test_columns_make_a_schema(make_batch):
+    queue = Queue()
+    writer = RecordWriter(queue)
+    writer.add(make_batch('article', ('url', 'title'),
+                          ('http://nu.nl/1', 'a')))
+    writer.add(make_batch('article', ('url', 'title', 'date'),
+                          ('http://nu.nl/2', 'b', '2018')))
+    writer.flush()
+    assert [(name, [sorted(objct) for objct in objects])
+            for name, objects in read(queue)] == [
+        ('article', [['title', 'url']]),
+        ('article', [['date', 'title', 'url']])]
+
+
+def test_batch_size(make_batch):
+    queue = Queue()
+    writer = RecordWriter(queue, batch_size=2)
+    writer.add(make_batch('article', ('url',), ('http://nu.nl/1',)))
+    assert queue.empty()
+    writer.add(make_batch('article', ('url',), ('http://nu.nl/2',)))
+    assert queue.qsize() == 1
+    writer.flush()
+    assert queue.qsize() == 1
+
+
+def test_due(make_batch):
+    writer = RecordWriter(Queue(), max_age=0)
+    assert not writer.due()
+    writer.add(make_batch('article', ('url',), ('http://nu.nl/1',)))
+    assert writer.due()
+
+
+@pytest.mark.parametrize('packer', ['msgpack', 'pickle'])
+def test_encode(monkeypatch, packer):
+    if packer == 'pickle':
+        monkeypatch.setattr(records, 'msgpack', None)
+    elif records.msgpack is None:
+        pytest.skip('msgpack is not installed')
+    message = ([(0, 'a', 'db', 'table', 'create', {}, ('url',))],
+               [(0, [('http://nu.nl/',)])])
+    data = encode(message)
+    assert data[:1] == packer[:1].encode()
+    new_schemas, rows = decode(data)
+    assert list(new_schemas[0]) == list(message[0][0])
+    assert rows[0][1][0][0] == 'http://nu.nl/'
+
+
+def test_encode_falls_back_to_pickle():
+    message = ([], [(0, [(datetime.date(2018, 1, 1), {'a'})])])
+    data = encode(message)
+    assert data[:1] == b'p'
+    assert decode(data) == message
@@ -0,0 +1,189 @@
+from queue import Empty, Queue
+from types import SimpleNamespace
+import time
+
+import pytest
+
+from modelscraper.scheduling import (ConcurrencyController, DeadLetters,
+                                     Hosts, HostScheduler, RetryQueue)
+
+
+@pytest.fixture
+def scheduler(make_source):
+    def make(*urls, **kwargs):
+        in_q = Queue()
+        for url in urls:
+            in_q.put(make_source(url))
+        return HostScheduler(in_q, **kwargs)
+
+    return make
+
+
+def test_hosts_take_turns(scheduler):
+    hosts = scheduler('http://a.nl/1', 'http://a.nl/2', 'http://b.nl/1')
+    urls = [hosts.get(0).url for _ in range(3)]
+    assert urls == ['http://a.nl/1', 'http://b.nl/1', 'http://a.nl/2']
+    assert hosts.empty()
+
+
+def test_delay_between_requests_to_a_host(scheduler):
+    hosts = scheduler('http://a.nl/1', 'http://a.nl/2', 'http://b.nl/1',
+                      delay=0.2)
+    assert hosts.get(0).url == 'http://a.nl/1'
+    assert hosts.get(0).url == 'http://b.nl/1'
+    with pytest.raises(Empty):
+        hosts.get(0.05)
+    start = time.time()
+    assert hosts.get(1).url == 'http://a.nl/2'
+    assert time.time() - start > 0.1
+
+
+def test_source_overrides_delay(make_source):
+    in_q = Queue()
+    in_q.put(make_source('http://a.nl/1', host_delay=0))
+    in_q.put(make_source('http://a.nl/2', host_delay=0))
+    hosts = HostScheduler(in_q, delay=10)
+    assert hosts.get(0).url == 'http://a.nl/1'
+    assert hosts.get(0).url == 'http://a.nl/2'
+
+
+def test_concurrency_per_host(scheduler):
+    hosts = scheduler('http://a.nl/1', 'http://a.nl/2', concurrency=1)
+    first = hosts.get(0)
+    with pytest.raises(Empty):
+        hosts.get(0.05)
+    hosts.done(first)
+    assert hosts.get(0).url == 'http://a.nl/2'
+
+
+def test_clear(scheduler):
+    hosts = scheduler('http://a.nl/1', 'http://a.nl/2', delay=10)
+    hosts.get(0)
+    with pytest.raises(Empty):
+        hosts.get(0)
+    assert hosts.qsize() == 1
+    assert [source.url for source in hosts.clear()] == ['http://a.nl/2']
+    assert hosts.empty()
+
+
+def test_retry_backoff(monkeypatch, make_source):
+    monkeypatch.setattr('random.uniform', lambda low, high: high)
+    retries = RetryQueue(base=1, max_delay=3)
+    source = make_source('http://a.nl/')
+    now = time.time()
+    delays = []
+    for _ in range(4):
+        assert retries.push(source)
+        delays.append(round(retries.next_due() - now))
+        retries.clear()
+    assert delays == [1, 2, 3, 3]
+
+
+def test_retry_due(make_source):
+    retries = RetryQueue(base=1)
+    source = make_source('http://a.nl/')
+    retries.push(source)
+    assert retries.pop_due(time.time()) == []
+    assert len(retries) == 1
+    assert retries.pop_due(time.time() + 2) == [source]
+    assert len(retries) == 0
+
+
+def test_retries_used_up(tmpdir, make_source):
+    dead_letters = DeadLetters(str(tmpdir.join('dead')))
+    retries = RetryQueue(dead_letters)
+    source = make_source('http://a.nl/', retries=1)
+    assert retries.push(source, 'timeout')
+    assert not retries.push(source, 'timeout')
+    letters = list(dead_letters.read())
+    assert [(letter['url'], letter['attempts'], letter['error'])
+            for letter in letters] == [('http://a.nl/', 2, 'timeout')]
+
+
+def test_scheduler_hands_out_due_retries(make_source):
+    retries = RetryQueue(base=0.1, max_delay=0.1)
+    hosts = HostScheduler(Queue(), retries=retries)
+    source = make_source('http://a.nl/')
+    retries.push(source)
+    assert not hosts.empty()
+    assert hosts.get(1) is source
+
+
+def test_no_delay_without_request(scheduler):
+    hosts = scheduler('http://a.nl/1', 'http://a.nl/2', 'http://a.nl/3',
+                      delay=10)
+    first = hosts.get(0)
+    hosts.done(first, requested=False)
+    second = hosts.get(0)
+    assert second.url == 'http://a.nl/2'
+    hosts.done(second)
+    with pytest.raises(Empty):
+        hosts.get(0)
+
+
+def test_in_order_without_per_host(scheduler):
+    hosts = scheduler('1', '2', '3', delay=10, concurrency=1)
+    hosts.per_host = False
+    urls = [hosts.get(0).url for _ in range(3)]
+    assert urls == ['1', '2', '3']
+
+
+def test_shared_hosts(scheduler):
+    hosts = Hosts()
+    first = scheduler('http://a.nl/1', delay=10, concurrency=2, hosts=hosts)
+    second = scheduler('http://a.nl/2', 'http://a.nl/3', delay=0,
+                       concurrency=2, hosts=hosts)
+    assert first.get(0).url == 'http://a.nl/1'
+    # The delay of the first scheduler holds for the second one.
+    with pytest.raises(Empty):
+        second.get(0)
+    hosts.ready_at.clear()
+    source = second.get(0)
+    assert source.url == 'http://a.nl/2'
+    # Both sources count for the concurrency of the host.
+    with pytest.raises(Empty):
+        second.get(0)
+    second.done(source)
+    assert second.get(0).url == 'http://a.nl/3'
+
+
+def controller(mean=0.1, **kwargs):
+    # A worker that made ten requests with the given mean get time.
+    worker = SimpleNamespace(visited=10, total_time=10 * mean)
+    return ConcurrencyController(SimpleNamespace(workers=[worker]), **kwargs)
+
+
+def test_controller_limits_requests():
+    limiter = controller(start=2)
+    assert limiter.acquire(0)
+    assert limiter.acquire(0)
+    assert not limiter.acquire(0.01)
+    limiter.release()
+    assert limiter.limit == 2
+    assert limiter.acquire(0)
+
+
+def test_controller_grows_while_healthy():
+    limiter = controller(start=2, maximum=3)
+    for _ in range(2):
+        limiter.acquire(0)
+        limiter.release(latency=0.1)
+    # One more request per round of requests.
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+    for _ in range(10):
+        limiter.acquire(0)
+        limiter.release(latency=0.1)
+    assert limiter.limit == 3
+
+
+def test_controller_backs_off_once_per_round_trip():
+    limiter = controller(start=8)
+    for _ in range(3):
+        limiter.acquire(0)
+        limiter.release(latency=0.1, throttled=True)
+    assert limiter.limit == 4
+    limiter.last_decrease = 0
+    limiter.acquire(0)
+    # A request that is much slower than the mean also backs off.
+    limiter.release(latency=1)
+    assert limiter.limit == 2
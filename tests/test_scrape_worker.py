@@ -0,0 +1,97 @@
+from collections import deque
+
+import pytest
+
+from modelscraper.components import Attr, Phase, Source, Template
+from modelscraper.frontier import Frontier
+from modelscraper.parsers import HTMLParser
+
+
+def required_worker(make_worker, sources):
+    template = Template(name='article', selector='article', required=True,
+                        attrs=[Attr(name='title', selector='h1',
+                                    func='sel_text')])
+    phase = Phase(sources=sources, templates=[template], frontier_size=4)
+    worker = make_worker(phase)
+    worker.phase = phase
+    worker.parser = HTMLParser(parent=worker, templates=phase.templates)
+    return worker
+
+
+def parse_without_articles(worker):
+    source = worker.scheduler.get(0)
+    source.data = b'<html><body><p>No articles</p></body></html>'
+    worker._parse(source, deque())
+
+
+def test_required_template_stops_the_sources(make_worker):
+    taken = []
+
+    def pages():
+        for i in range(100):
+            taken.append(i)
+            yield Source(url='http://nu.nl/page/{}'.format(i))
+
+    worker = required_worker(make_worker, pages())
+    worker.add_sources(worker.phase)
+    assert len(taken) == 4
+
+    parse_without_articles(worker)
+    worker._fill_frontier()
+    assert worker.scheduler.qsize() == 0
+    assert worker.in_flight.idle()
+    assert worker.sources_exhausted
+    assert len(taken) == 4
+
+
+def test_cleared_sources_leave_the_frontier(make_worker):
+    worker = required_worker(make_worker, [
+        Source(url='http://nu.nl/page/{}'.format(i)) for i in range(3)])
+    worker.frontier = Frontier('test.frontier')
+    worker.add_sources(worker.phase)
+    parse_without_articles(worker)
+    worker.frontier.checkpoint()
+    assert worker.frontier.pending(0) == []
+
+
+def test_source_condition_on_compiled_values(make_worker):
+    cars = ''.join(
+        '<div class="car"><span class="amount">{0}</span>'
+        '<a href="http://nu.nl/car/{0}">car</a></div>'.format(amount)
+        for amount in (1, 5, 10))
+    template = Template(name='car', selector='div.car', attrs=[
+        Attr(name='amount', selector='span.amount', func='sel_text'),
+        Attr(name='url', selector='a', func='sel_url',
+             source=Source(), source_condition={'amount': '> 2'})])
+    phase = Phase(sources=[Source(url='http://nu.nl/cars')],
+                  templates=[template])
+    worker = make_worker(phase)
+    worker.phase = phase
+    worker.parser = HTMLParser(parent=worker, templates=phase.templates)
+    worker.add_sources(phase)
+
+    source = worker.scheduler.get(0)
+    source.data = '<html><body>{}</body></html>'.format(cars).encode()
+    worker._parse(source, deque())
+    assert [source.url for source in worker.source_q.queue] == \
+        ['http://nu.nl/car/5', 'http://nu.nl/car/10']
+
+
+def test_host_delay_of_the_configured_workers(make_worker):
+    phase = Phase(sources=[], templates=[], n_workers=2, concurrency=8,
+                  adaptive=True)
+    worker = make_worker(phase, time_out=0.4)
+    worker.spawn_workforce(phase)
+    # All workers are started for the controller, the delay is the one
+    # of the two configured workers.
+    assert len(worker.workers) == 8
+    assert worker.scheduler.delay == 0.2
+
+
+def test_pipeline_can_not_be_checkpointed(make_worker):
+    phase = Phase(sources=[], templates=[])
+    with pytest.raises(Exception, match='checkpointed'):
+        make_worker(phase, pipeline=True, checkpoint=True)
+    with pytest.raises(Exception, match='repeat'):
+        make_worker(Phase(sources=[], templates=[], repeat=True),
+                    pipeline=True)
@@ -0,0 +1,64 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import time
+
+import pytest
+
+from modelscraper import sources
+from modelscraper.components import Phase, Source
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 429 if self.path == '/busy' else 200
+        body = self.path.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.skipif(sources.aiohttp is None, reason='aiohttp is not installed')
+def test_async_web_source(make_worker, server):
+    phase = Phase(sources=[], templates=[], concurrency=4,
+                  source_worker=sources.AsyncWebSource)
+    worker = make_worker(phase, host_delay=0)
+    worker.phase = phase
+    worker.spawn_workforce(phase)
+    for i in range(6):
+        worker._enqueue(Source(url='{}/page/{}'.format(server, i)))
+    worker._enqueue(Source(url=server + '/busy', retries=0))
+
+    received = [worker.parse_q.get(timeout=5) for _ in range(6)]
+    assert sorted(source.data for source in received) == \
+        [('/page/{}'.format(i)).encode() for i in range(6)]
+    # The throttled source has no retries left and is dropped, the pages
+    # wait for the parser.
+    deadline = time.time() + 5
+    while worker.in_flight.count > 6 and time.time() < deadline:
+        time.sleep(0.01)
+    assert worker.in_flight.count == 6
+
+    worker.stop_workers()
+    assert not any(thread.is_alive() for thread in worker.workers)
+
+
+def test_async_web_source_needs_aiohttp(make_worker, monkeypatch):
+    monkeypatch.setattr(sources, 'aiohttp', None)
+    phase = Phase(sources=[], templates=[])
+    worker = make_worker(phase)
+    worker.phase = phase
+    with pytest.raises(ImportError):
+        sources.AsyncWebSource(parent=worker)
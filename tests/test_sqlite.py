@@ -0,0 +1,57 @@
+import pytest
+
+from modelscraper.databases.sqlite import SQLite
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+
+def test_round_trip(make_batch, run_store):
+    store = SQLite()
+    batch = make_batch('article', ('url', 'title', 'tags'),
+                       (('http://nu.nl/1',), ('One',), ('a', 'b')),
+                       (('http://nu.nl/2',), ('Two',), None))
+    run_store(store, batch)
+    assert list(store.read(batch)) == [
+        {'url': 'http://nu.nl/1', 'title': ['One'], 'tags': ['a', 'b']},
+        {'url': 'http://nu.nl/2', 'title': ['Two'], 'tags': None}]
+    assert list(store.read(batch, url='http://nu.nl/2'))[0]['title'] == \
+        ['Two']
+    assert list(store.read_urls(batch)) == ['http://nu.nl/1',
+                                            'http://nu.nl/2']
+    assert store.urls_stored(batch, ['http://nu.nl/2', 'http://nu.nl/3']) \
+        == {'http://nu.nl/2'}
+
+
+def test_new_columns_are_added(make_batch, run_store):
+    store = SQLite(cache=1)
+    batch = make_batch('article', ('url', 'title', 'date'),
+                       ('http://nu.nl/2', 'Two', '2018'))
+    run_store(store, make_batch('article', ('url', 'title'),
+                                ('http://nu.nl/1', 'One')), batch)
+    assert list(store.read(batch)) == [
+        {'url': 'http://nu.nl/1', 'title': 'One', 'date': None},
+        {'url': 'http://nu.nl/2', 'title': 'Two', 'date': '2018'}]
+
+
+def test_update(make_batch, run_store):
+    store = SQLite()
+    kwargs = {'func': 'update', 'kws': {'key': 'title'}}
+    run_store(store, make_batch('article', ('url', 'title', 'views'),
+                                ('http://nu.nl/1', 'One', 1),
+                                ('http://nu.nl/2', 'Two', 1), **kwargs))
+    batch = make_batch('article', ('url', 'title', 'views'),
+                       ('http://nu.nl/1', 'One', 2), **kwargs)
+    run_store(SQLite(), batch)
+    assert [(row['title'], row['views']) for row in store.read(batch)] == \
+        [('One', 2), ('Two', 1)]
+
+
+def test_nothing_stored(make_batch):
+    batch = make_batch('article', ('url',))
+    store = SQLite()
+    assert list(store.read(batch)) == []
+    assert list(store.read_urls(batch)) == []
+    assert store.urls_stored(batch, ['http://nu.nl/1']) == set()
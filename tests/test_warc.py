@@ -0,0 +1,96 @@
+from threading import Event
+import gzip
+import os
+
+from modelscraper.cache import fingerprint
+from modelscraper.components import Phase, Source
+from modelscraper.sources import ReplaySource, WebSource
+from modelscraper.warc import (WarcArchive, WarcWriter, open_archive,
+                               parse_http_response)
+
+
+def record(writer, url, body, status=200, headers=None):
+    key = fingerprint('get', url)
+    writer.record(key, 'get', url, {'User-Agent': 'test'}, None, status,
+                  'OK', headers or {}, body, 0, 0.1)
+    return key
+
+
+def test_round_trip(tmpdir):
+    writer = WarcWriter(str(tmpdir), max_size=1)
+    writer.start()
+    first = record(writer, 'http://a.nl/1', b'one',
+                   headers={'Content-Type': 'text/html',
+                            'Content-Encoding': 'gzip'})
+    second = record(writer, 'http://a.nl/2?page=2', b'two', status=404)
+    writer.stop()
+    # A new file is started after max_size bytes.
+    assert len(tmpdir.listdir(lambda path: path.ext == '.gz')) == 2
+
+    archive = open_archive(str(tmpdir))
+    assert len(archive) == 2
+    status, headers, body = archive.response(first)
+    assert (status, body) == (200, b'one')
+    assert headers['content-type'] == 'text/html'
+    # The body is stored decoded.
+    assert 'content-encoding' not in headers
+    assert archive.response(second)[::2] == (404, b'two')
+    assert archive.body(fingerprint('get', 'http://a.nl/3')) is None
+
+
+def test_index_is_rebuilt(tmpdir):
+    writer = WarcWriter(str(tmpdir))
+    writer.start()
+    key = record(writer, 'http://a.nl/1', b'one')
+    writer.stop()
+    for index in tmpdir.listdir(lambda path: path.ext == '.idx'):
+        index.remove()
+    assert open_archive(str(tmpdir)).body(key) == b'one'
+    # The index is written again next to the archive.
+    assert tmpdir.listdir(lambda path: path.ext == '.idx')
+
+
+def warc_record(warc_type, url, content):
+    return ('WARC/1.0\r\nWARC-Type: {}\r\nWARC-Target-URI: {}\r\n'
+            'Content-Length: {}\r\n\r\n'.format(warc_type, url, len(content))
+            ).encode() + content + b'\r\n\r\n'
+
+
+def test_other_archives(tmpdir):
+    # Archives of other tools have no fingerprints and are not always
+    # compressed, their responses are found by the url of a GET request.
+    chunked = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+               b'3\r\none\r\n0\r\n\r\n')
+    compressed = (b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n\r\n' +
+                  gzip.compress(b'two'))
+    path = str(tmpdir.join('other.warc'))
+    with open(path, 'wb') as fle:
+        fle.write(warc_record('request', 'http://a.nl/1', b'GET /1'))
+        fle.write(warc_record('response', 'http://a.nl/1', chunked))
+        fle.write(warc_record('response', 'http://a.nl/2', compressed))
+    archive = WarcArchive([path])
+    assert archive.body(fingerprint('get', 'http://a.nl/1')) == b'one'
+    assert archive.body(fingerprint('get', 'http://a.nl/2')) == b'two'
+
+
+def test_parse_http_response():
+    status, headers, body = parse_http_response(
+        b'HTTP/1.1 301 Moved\r\nLocation: /b\r\n\r\n')
+    assert (status, headers, body) == (301, {'location': '/b'}, b'')
+
+
+def test_record_and_replay(make_worker, make_session):
+    session = make_session({'content': b'page'})
+    worker = make_worker(Phase(sources=[], templates=[]), session=session)
+    worker.recorder = WarcWriter('recording')
+    worker.recorder.start()
+    web = WebSource(parent=worker, stop_event=Event())
+    web.retrieve(Source(url='http://a.nl/', params={'q': 1}))
+    worker.recorder.stop()
+    assert os.listdir('recording')
+
+    worker.archive = open_archive('recording')
+    replay = ReplaySource(parent=worker, stop_event=Event())
+    source = replay.retrieve(Source(url='http://a.nl/', params={'q': 1}))
+    assert source.data == b'page'
+    assert replay.retrieve(Source(url='http://a.nl/other')) is None